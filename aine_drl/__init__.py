@@ -12,6 +12,7 @@ from .exp import (
 from .policy_dist import PolicyDist
 from .net import (
     Trainer,
+    DistributedTrainer,
     Network,
     RecurrentNetwork
 )
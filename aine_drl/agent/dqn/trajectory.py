@@ -1,9 +1,7 @@
-import operator
 from dataclasses import dataclass
 
 import torch
 
-import aine_drl.util.func as util_f
 from aine_drl.exp import Action, Observation
 
 
@@ -50,13 +48,13 @@ class DQNTrajectory:
         self._count = 0
         self._recent_idx = -1
         
-        # the batch size of each item is 1
-        self._obs_buffer: list[Observation] = self._make_buffer()
-        self._action_buffer: list[Action] = self._make_buffer()
-        self._reward_buffer: list[torch.Tensor] = self._make_buffer()
-        self._terminated_buffer: list[torch.Tensor] = self._make_buffer()
+        # buffers whose shape is `(capacity, *shape)` are allocated when the first experience is added
+        self._obs_buffer: Observation = None # type: ignore
+        self._action_buffer: Action = None # type: ignore
+        self._reward_buffer: torch.Tensor = None # type: ignore
+        self._terminated_buffer: torch.Tensor = None # type: ignore
         
-        self._final_next_obs: list[Observation] = [None] * self._num_envs # type: ignore
+        self._final_next_obs: Observation = None # type: ignore
         
     @property
     def can_sample(self) -> bool:
@@ -68,31 +66,36 @@ class DQNTrajectory:
         self._n_steps += 1
         exp = exp.to(self._device)
         
-        for i in range(self._num_envs):
-            self._recent_idx = (self._recent_idx + 1) % self._capacity
-            self._count = min(self._count + 1, self._capacity)
-            
-            self._obs_buffer[self._recent_idx] = exp.obs[i:i+1]
-            self._action_buffer[self._recent_idx] = exp.action[i:i+1]
-            self._reward_buffer[self._recent_idx] = exp.reward[i:i+1]
-            self._terminated_buffer[self._recent_idx] = exp.terminated[i:i+1]
-            self._final_next_obs[i] = exp.next_obs[i:i+1]
+        if self._reward_buffer is None:
+            self._allocate_buffer(exp)
+        
+        # each environment experience is stored in order of the environment id
+        buffer_idx = (self._recent_idx + 1 + torch.arange(self._num_envs, device=self._device)) % self._capacity
+        self._recent_idx = (self._recent_idx + self._num_envs) % self._capacity
+        self._count = min(self._count + self._num_envs, self._capacity)
+        
+        self._obs_buffer[buffer_idx] = exp.obs
+        self._action_buffer.discrete_action[buffer_idx] = exp.action.discrete_action
+        self._action_buffer.continuous_action[buffer_idx] = exp.action.continuous_action
+        self._reward_buffer[buffer_idx] = exp.reward
+        self._terminated_buffer[buffer_idx] = exp.terminated
+        self._final_next_obs = exp.next_obs
         
     def sample(self, device: torch.device) -> DQNExperience:
         """Samples experience batch from it. Default sampling distribution is uniform."""
         self._n_steps = 0
         sample_idx = self._sample_idx()
         
-        obs = Observation.from_iter(util_f.get_items(self._obs_buffer, sample_idx))
-        action = Action.from_iter(util_f.get_items(self._action_buffer, sample_idx))
+        obs = self._obs_buffer[sample_idx]
+        action = self._action_buffer[sample_idx]
         next_obs = self._sample_next_obs(sample_idx)
-        reward = torch.cat(util_f.get_items(self._reward_buffer, sample_idx), dim=0)
-        terminated = torch.cat(util_f.get_items(self._terminated_buffer, sample_idx), dim=0)
+        reward = self._reward_buffer[sample_idx]
+        terminated = self._terminated_buffer[sample_idx]
         
         return DQNExperience(obs, action, next_obs, reward, terminated).to(device=device)
     
     def _sample_idx(self) -> torch.Tensor:
-        batch_idx = torch.randint(self._count, size=(self._sample_batch_size,))
+        batch_idx = torch.randint(self._count, size=(self._sample_batch_size,), device=self._device)
         return batch_idx
         
     def _sample_next_obs(self, batch_idx: torch.Tensor) -> Observation:
@@ -110,24 +113,23 @@ class DQNTrajectory:
         # if batch_idx is 1 (recent2), then 2 (recent_idx=recent3) < 1+3 (next_obs_idx=oldest2) <= 2+3
         # case 2) [prev1, prev2, prev3, recent1, recent2, recent3]
         # if batch_idx is 4 (recent2), then 5 (recent_idx=recent3) < 4+3 (next_obs_idx not exists) < 5+3
-        not_exsists_next_obs = torch.argwhere(
-            (self._recent_idx < next_obs_idx) & (next_obs_idx <= self._recent_idx + self._num_envs)
-        ).flatten()
-        # check if there is any indexes to get from buffer
-        do_replace = len(not_exsists_next_obs) != 0
-        if do_replace:
-            # recent_idx < next_obs_idx <= recent_idx + num_envs
-            # i.e. 0 <= next_obs_idx - recent_idx - 1 < num_envs
-            final_next_obs_idx = next_obs_idx[not_exsists_next_obs] - self._recent_idx - 1
-            # to avoid index out of range exception due to the case 2
-            next_obs_idx[not_exsists_next_obs] = 0
-        # get the next obs batch
-        next_obs = Observation.from_iter(util_f.get_items(self._obs_buffer, next_obs_idx))
-        if do_replace:
-            # replace them
-            next_obs[not_exsists_next_obs] = Observation.from_iter(util_f.get_items(self._final_next_obs, final_next_obs_idx)) # type: ignore
+        not_exsists_next_obs = (self._recent_idx < next_obs_idx) & (next_obs_idx <= self._recent_idx + self._num_envs)
+        # recent_idx < next_obs_idx <= recent_idx + num_envs
+        # i.e. 0 <= next_obs_idx - recent_idx - 1 < num_envs
+        # the other indexes are clamped only to avoid index out of range exception since they're not selected
+        final_next_obs_idx = (next_obs_idx - self._recent_idx - 1).clamp_(0, self._num_envs - 1)
+        # blend the next obs in the buffer and the final next obs at once
+        next_obs = Observation(tuple(
+            torch.where(not_exsists_next_obs.view((-1,) + (1,) * (obs.ndim - 1)), final_obs[final_next_obs_idx], obs[next_obs_idx])
+            for obs, final_obs in zip(self._obs_buffer.items, self._final_next_obs.items) # type: ignore
+        ))
         return next_obs
 
-    def _make_buffer(self) -> list:
-        return [None] * self._capacity
-    
\ No newline at end of file
+    def _allocate_buffer(self, exp: DQNExperience):
+        def make_buffer(like: torch.Tensor) -> torch.Tensor:
+            return torch.empty((self._capacity,) + like.shape[1:], dtype=like.dtype, device=self._device)
+        
+        self._obs_buffer = exp.obs.transform(make_buffer)
+        self._action_buffer = exp.action.transform(make_buffer)
+        self._reward_buffer = make_buffer(exp.reward)
+        self._terminated_buffer = make_buffer(exp.terminated)
@@ -20,6 +20,8 @@ class PPOConfig:
     value_loss_coef: float = 0.5
     entropy_coef: float = 0.001
     device: str | None = None
+    cuda_graph: bool = False
+    autocast: bool = False
     
 @dataclass(frozen=True)
 class RecurrentPPOConfig:
@@ -39,6 +41,9 @@ class RecurrentPPOConfig:
     value_loss_coef: float = 0.5
     entropy_coef: float = 0.001
     device: str | None = None
+    torch_compile: bool = False
+    cuda_graph: bool = False
+    autocast: bool = False
     
 @dataclass(frozen=True)
 class PPORNDConfig:
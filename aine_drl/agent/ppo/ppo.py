@@ -10,6 +10,7 @@ from aine_drl.agent.ppo.net import PPOSharedNetwork
 from aine_drl.agent.ppo.trajectory import PPOExperience, PPOTrajectory
 from aine_drl.exp import Action, Experience, Observation
 from aine_drl.net import NetworkTypeError, Trainer
+from aine_drl.util.cuda_graph import CUDAGraphFn
 from aine_drl.util.func import batch2perenv, perenv2batch
 
 
@@ -40,9 +41,17 @@ class PPO(Agent):
         self._action_log_prob: torch.Tensor = None # type: ignore
         self._state_value: torch.Tensor = None # type: ignore
         
+        # mixed precision feed forward when interacting with environment
+        self._autocast_dtype = torch.float16 if self.device.type == "cuda" else torch.bfloat16
+        
         self._actor_loss_mean = util.IncrementalMean()
         self._critic_loss_mean = util.IncrementalMean()
         
+        # the outputs of the CUDA graph are overwritten at every step, but they are copied into the trajectory before it
+        self._sample_action_fn = self._sample_action
+        if self._config.cuda_graph and self.device.type == "cuda":
+            self._sample_action_fn = CUDAGraphFn(self._sample_action)
+        
     @property
     def name(self) -> str:
         return "PPO"
@@ -67,19 +76,34 @@ class PPO(Agent):
     
     @torch.no_grad()
     def _select_action_train(self, obs: Observation) -> Action:
-        # feed forward 
-        policy_dist, v_pred = self._network.forward(obs)
+        # feed forward and sample action
+        discrete_action, continuous_action, self._action_log_prob, self._state_value = self._sample_action_fn(*obs.items)
+        return Action(discrete_action, continuous_action)
+    
+    def _sample_action(self, *obs_items: torch.Tensor) -> tuple[torch.Tensor, ...]:
+        """
+        Feed forward the observation `obs_items`, then sample action. 
+        It takes and returns only fixed-shape tensors since it can be captured into a CUDA graph.
         
-        # action sampling
+        Returns:
+            discrete_action (Tensor): `(num_envs, num_discrete_branches)`
+            continuous_action (Tensor): `(num_envs, num_continuous_branches)`
+            action_log_prob (Tensor): `(num_envs, 1)` in full precision
+            state_value (Tensor): `(num_envs, 1)` in full precision
+        """
+        # only the feed forward is autocast, the policy distribution is sampled in full precision
+        # the weight cast cache is disabled since it can't be captured into a CUDA graph
+        with torch.autocast(self.device.type, self._autocast_dtype, enabled=self._config.autocast, cache_enabled=False):
+            policy_dist, state_value = self._network.forward(Observation(obs_items))
         action = policy_dist.sample()
-        
-        # store data
-        self._action_log_prob = policy_dist.joint_log_prob(action)
-        self._state_value = v_pred
-        
-        return action
+        return (
+            action.discrete_action,
+            action.continuous_action,
+            policy_dist.joint_log_prob(action).float(),
+            state_value.float()
+        )
     
-    @torch.no_grad()
+    @torch.inference_mode()
     def _select_action_inference(self, obs: Observation) -> Action:
         policy_dist, _ = self._network.forward(obs)
         return policy_dist.sample()
@@ -9,7 +9,7 @@ from aine_drl.agent.ppo.trajectory import (RecurrentPPOExperience,
                                            RecurrentPPOTrajectory)
 from aine_drl.exp import Action, Experience, Observation
 from aine_drl.net import NetworkTypeError, Trainer
-from aine_drl.util.func import batch2perenv, perenv2batch
+from aine_drl.util.cuda_graph import CUDAGraphFn
 
 
 class RecurrentPPO(Agent):
@@ -41,16 +41,31 @@ class RecurrentPPO(Agent):
         hidden_state_shape = (network.hidden_state_shape()[0], self._num_envs, network.hidden_state_shape()[1])
         self._hidden_state = torch.zeros(hidden_state_shape, device=self.device)
         self._next_hidden_state = torch.zeros(hidden_state_shape, device=self.device)
-        self._prev_terminated = torch.zeros((self._num_envs, 1), device=self.device)
+        # the mask which resets the hidden state of the terminated environments, it's updated in-place on the device
+        self._prev_not_terminated = torch.ones((self._num_envs, 1), device=self.device)
+        self._shuffled_seq_batch_idx_buffer = torch.empty(self._num_envs * self._config.n_steps, dtype=torch.long, device=self.device)
         
         self._actor_loss_mean = util.IncrementalMean()
         self._critic_loss_mean = util.IncrementalMean()
         
+        # torch.compile() is available from PyTorch 2.0
+        self._loss_fn = self._compute_loss
+        if self._config.torch_compile and hasattr(torch, "compile"):
+            self._loss_fn = torch.compile(self._compute_loss, dynamic=True)
+        
+        # the outputs of the CUDA graph are overwritten at every step, but they are copied into the trajectory before it
+        self._sample_action_fn = self._sample_action
+        if self._config.cuda_graph and self.device.type == "cuda":
+            self._sample_action_fn = CUDAGraphFn(self._sample_action)
+        
+        # mixed precision feed forward when interacting with environment
+        self._autocast_dtype = torch.float16 if self.device.type == "cuda" else torch.bfloat16
+        
         # for inference mode
         infer_hidden_state_shape = (network.hidden_state_shape()[0], 1, network.hidden_state_shape()[1])
         self._infer_hidden_state = torch.zeros(infer_hidden_state_shape, device=self.device)
         self._infer_next_hidden_state = torch.zeros(infer_hidden_state_shape, device=self.device)
-        self._infer_prev_terminated = torch.zeros((1, 1), device=self.device)
+        self._infer_prev_not_terminated = torch.ones((1, 1), device=self.device)
         
     @property
     def name(self) -> str:
@@ -61,7 +76,7 @@ class RecurrentPPO(Agent):
         return self._config.__dict__
     
     def _update_train(self, exp: Experience):
-        self._prev_terminated = exp.terminated
+        self._prev_not_terminated.copy_(exp.terminated, non_blocking=True).neg_().add_(1.0)
         
         self._trajectory.add(RecurrentPPOExperience(
             **exp.__dict__,
@@ -74,35 +89,56 @@ class RecurrentPPO(Agent):
             self._train()
     
     def _update_inference(self, exp: Experience):
-        self._infer_prev_terminated = exp.terminated
+        self._infer_prev_not_terminated.copy_(exp.terminated, non_blocking=True).neg_().add_(1.0)
     
     @torch.no_grad()
     def _select_action_train(self, obs: Observation) -> Action:
-        self._hidden_state = self._next_hidden_state * (1.0 - self._prev_terminated)
+        torch.mul(self._next_hidden_state, self._prev_not_terminated, out=self._hidden_state)
         
-        # feed forward
-        # when interacting with environment, sequence length must be 1
-        # *batch_shape = (seq_batch_size, seq_len) = (num_envs, 1)
-        policy_dist_seq, state_value_seq, next_hidden_state = self._network.forward(
-            obs.transform(lambda o: o.unsqueeze(dim=1)),
+        # feed forward and sample action
+        discrete_action, continuous_action, self._action_log_prob, self._state_value, self._next_hidden_state = self._sample_action_fn(
+            *obs.items,
             self._hidden_state
         )
+        return Action(discrete_action, continuous_action)
+    
+    def _sample_action(self, *inputs: torch.Tensor) -> tuple[torch.Tensor, ...]:
+        """
+        Feed forward the observation and the hidden state `inputs`, then sample action. 
+        It takes and returns only fixed-shape tensors since it can be captured into a CUDA graph.
+        
+        Returns:
+            discrete_action (Tensor): `(num_envs, num_discrete_branches)`
+            continuous_action (Tensor): `(num_envs, num_continuous_branches)`
+            action_log_prob (Tensor): `(num_envs, 1)` in full precision
+            state_value (Tensor): `(num_envs, 1)` in full precision
+            next_hidden_state (Tensor): `(D x num_layers, num_envs, H)` in full precision
+        """
+        # when interacting with environment, sequence length must be 1
+        # *batch_shape = (seq_batch_size, seq_len) = (num_envs, 1)
+        # only the feed forward is autocast, the policy distribution is sampled in full precision
+        # the weight cast cache is disabled since it can't be captured into a CUDA graph
+        with torch.autocast(self.device.type, self._autocast_dtype, enabled=self._config.autocast, cache_enabled=False):
+            policy_dist_seq, state_value_seq, next_hidden_state = self._network.forward(
+                Observation(tuple(o.unsqueeze(dim=1) for o in inputs[:-1])),
+                inputs[-1]
+            )
         
         # action sampling
         action_seq = policy_dist_seq.sample()
         
         # (num_envs, 1, *shape) -> (num_envs, *shape)
-        action = action_seq.transform(lambda a: a.squeeze(dim=1))
-        self._action_log_prob = policy_dist_seq.joint_log_prob(action_seq).squeeze_(dim=1)
-        self._state_value = state_value_seq.squeeze_(dim=1)
-        
-        self._next_hidden_state = next_hidden_state
-        
-        return action
+        return (
+            action_seq.discrete_action.squeeze(dim=1),
+            action_seq.continuous_action.squeeze(dim=1),
+            policy_dist_seq.joint_log_prob(action_seq).squeeze(dim=1).float(),
+            state_value_seq.squeeze(dim=1).float(),
+            next_hidden_state.float()
+        )
     
-    @torch.no_grad()
+    @torch.inference_mode()
     def _select_action_inference(self, obs: Observation) -> Action:
-        self._infer_hidden_state = self._infer_next_hidden_state * (1.0 - self._infer_prev_terminated)
+        torch.mul(self._infer_next_hidden_state, self._infer_prev_not_terminated, out=self._infer_hidden_state)
         policy_dist_seq, _, next_hidden_state = self._network.forward(
             obs.transform(lambda o: o.unsqueeze(dim=1)),
             self._infer_hidden_state
@@ -126,70 +162,72 @@ class RecurrentPPO(Agent):
             self._config.padding_value
         )
         
-        def add_to_seq_gen(batch, start_idx = 0, seq_len = 0):
-            seq_generator.add(batch2perenv(batch, self._num_envs), start_idx=start_idx, seq_len=seq_len)
-            
-        add_to_seq_gen(exp_batch.hidden_state.swapaxes(0, 1), seq_len=1)
+        # the empty action branch is skipped
+        has_discrete_action = exp_batch.action.num_discrete_branches > 0
+        has_continuous_action = exp_batch.action.num_continuous_branches > 0
+        
+        seq_generator.add(exp_batch.hidden_state, seq_len=1)
         for obs_tensor in exp_batch.obs.items:
-            add_to_seq_gen(obs_tensor)
-        if exp_batch.action.num_discrete_branches > 0:
-            add_to_seq_gen(exp_batch.action.discrete_action)
-        else:
-            seq_generator.add(torch.empty((self._num_envs, self._config.n_steps, 0)))
-        if exp_batch.action.num_continuous_branches > 0:
-            add_to_seq_gen(exp_batch.action.continuous_action)
-        else:
-            seq_generator.add(torch.empty((self._num_envs, self._config.n_steps, 0)))
-        add_to_seq_gen(exp_batch.action_log_prob)
-        add_to_seq_gen(advantage)
-        add_to_seq_gen(target_state_value)
-        
-        sequences = seq_generator.generate(batch2perenv(exp_batch.terminated, self._num_envs).unsqueeze_(-1))
+            seq_generator.add(obs_tensor)
+        if has_discrete_action:
+            seq_generator.add(exp_batch.action.discrete_action)
+        if has_continuous_action:
+            seq_generator.add(exp_batch.action.continuous_action)
+        seq_generator.add(exp_batch.action_log_prob)
+        seq_generator.add(advantage)
+        seq_generator.add(target_state_value)
+        
+        sequences = seq_generator.generate(exp_batch.terminated)
         mask = sequences[0]
         seq_init_hidden_state = sequences[1]
         obs_seq = Observation(sequences[2:2 + exp_batch.obs.num_items])
-        discrete_action_seq, continuous_action_seq, old_action_log_prob_seq, advantage_seq, target_state_value_seq = sequences[2 + exp_batch.obs.num_items:]
+        action_seq_end_idx = 2 + exp_batch.obs.num_items + has_discrete_action + has_continuous_action
+        action_seqs = iter(sequences[2 + exp_batch.obs.num_items:action_seq_end_idx])
+        discrete_action_seq = next(action_seqs) if has_discrete_action else None
+        continuous_action_seq = next(action_seqs) if has_continuous_action else None
+        old_action_log_prob_seq, advantage_seq, target_state_value_seq = sequences[action_seq_end_idx:]
         
-        num_seq = len(mask)
+        num_seq, max_seq_len = mask.shape
         # (num_seq, 1, D x num_layers, H) -> (D x num_layers, num_seq, H)
-        seq_init_hidden_state = seq_init_hidden_state.squeeze_(dim=1).swapaxes_(0, 1)
+        seq_init_hidden_state = seq_init_hidden_state.permute(2, 0, 1, 3).reshape(-1, num_seq, seq_init_hidden_state.shape[-1])
+        
+        # the data used only at the valid time steps are flattened to be gathered at once: (num_seq, max_seq_len, 1) -> (num_seq x max_seq_len, 1)
+        flat_old_action_log_prob = old_action_log_prob_seq.flatten(0, 1)
+        flat_advantage = advantage_seq.flatten(0, 1)
+        flat_target_state_value = target_state_value_seq.flatten(0, 1)
+        
+        # the number of sequences is at most the number of experiences
+        shuffled_seq_batch_idx = self._shuffled_seq_batch_idx_buffer[:num_seq]
+        seq_mini_batch_size = self._config.seq_mini_batch_size
+        # the number of sequences depends on the episode boundaries, so it's agreed in distributed training
+        num_seq_mini_batches = self._trainer.agree_num_steps(num_seq // seq_mini_batch_size)
         
         for _ in range(self._config.epoch):
-            shuffled_seq_batch_idx = torch.randperm(num_seq)
-            for i in range(num_seq // self._config.seq_mini_batch_size):
-                # when sliced by sample_seq_idx, (entire_seq_batch_size,) -> (seq_mini_batch_size,)
-                sample_seq_idx = shuffled_seq_batch_idx[self._config.seq_mini_batch_size * i : self._config.seq_mini_batch_size * (i + 1)]
-                # when masked by sample_mask, (seq_mini_batch_size, seq_len) -> (masked_batch_size,)
-                sample_mask = mask[sample_seq_idx]
-                
-                # feed forward
-                sample_policy_dist_seq, sample_state_value_seq, _ = self._network.forward(
-                    obs_seq[sample_seq_idx], 
-                    seq_init_hidden_state[:, sample_seq_idx]
-                )
+            torch.randperm(num_seq, out=shuffled_seq_batch_idx)
+            for i in range(num_seq_mini_batches):
+                # when selected by sample_seq_idx, (entire_seq_batch_size,) -> (seq_mini_batch_size,)
+                sample_seq_idx = shuffled_seq_batch_idx.narrow(0, seq_mini_batch_size * i, seq_mini_batch_size)
+                select = lambda x: x.index_select(0, sample_seq_idx)
                 
-                # compute actor loss
-                sample_action_seq = Action(
-                    discrete_action_seq[sample_seq_idx],
-                    continuous_action_seq[sample_seq_idx]
-                )
-                sample_new_action_log_prob_seq = sample_policy_dist_seq.joint_log_prob(sample_action_seq)
-                actor_loss = L.ppo_clipped_loss(
-                    advantage_seq[sample_seq_idx][sample_mask],
-                    old_action_log_prob_seq[sample_seq_idx][sample_mask],
-                    sample_new_action_log_prob_seq[sample_mask],
-                    self._config.epsilon_clip
-                )
-                entropy = sample_policy_dist_seq.joint_entropy()[sample_mask].mean()
+                # the valid time steps of the flattened mini-batch (masked_batch_size,) and of the entire flattened batch
+                sample_valid_idx = select(mask).flatten().nonzero().squeeze_(dim=-1)
+                valid_idx = sample_seq_idx[sample_valid_idx // max_seq_len] * max_seq_len + sample_valid_idx % max_seq_len
                 
-                # compute critic loss
-                critic_loss = L.bellman_value_loss(
-                    sample_state_value_seq[sample_mask], 
-                    target_state_value_seq[sample_seq_idx][sample_mask]
+                # compute loss
+                loss, actor_loss, critic_loss = self._loss_fn(
+                    obs_seq.transform(select),
+                    seq_init_hidden_state.index_select(1, sample_seq_idx),
+                    Action(
+                        select(discrete_action_seq) if discrete_action_seq is not None else None,
+                        select(continuous_action_seq) if continuous_action_seq is not None else None
+                    ),
+                    flat_old_action_log_prob.index_select(0, valid_idx),
+                    flat_advantage.index_select(0, valid_idx),
+                    flat_target_state_value.index_select(0, valid_idx),
+                    sample_valid_idx
                 )
                 
                 # train step
-                loss = actor_loss + self._config.value_loss_coef * critic_loss - self._config.entropy_coef * entropy
                 self._trainer.step(loss, self.training_steps)
                 self._tick_training_steps()
                 
@@ -197,46 +235,82 @@ class RecurrentPPO(Agent):
                 self._actor_loss_mean.update(actor_loss.item())
                 self._critic_loss_mean.update(critic_loss.item())
 
+    def _compute_loss(
+        self,
+        obs_seq: Observation,
+        init_hidden_state: torch.Tensor,
+        action_seq: Action,
+        old_action_log_prob: torch.Tensor,
+        advantage: torch.Tensor,
+        target_state_value: torch.Tensor,
+        valid_idx: torch.Tensor
+    ) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """
+        Feed forward the sequence mini-batch and compute the loss. 
+        It has no host synchronization like `item()` since it can be compiled.
+        
+        Args:
+            old_action_log_prob, advantage, target_state_value (Tensor): `(masked_batch_size, 1)` at the valid time steps
+            valid_idx (Tensor): `(masked_batch_size,)` indices of the valid time steps in the flattened sequence mini-batch
+        
+        Returns:
+            loss (Tensor): scalar loss to be optimized
+            actor_loss (Tensor): detached actor loss
+            critic_loss (Tensor): detached critic loss
+        """
+        # (seq_mini_batch_size, seq_len, *shape) -> (masked_batch_size, *shape)
+        select_valid = lambda x: x.flatten(0, 1).index_select(0, valid_idx)
+        
+        # feed forward
+        policy_dist_seq, state_value_seq, _ = self._network.forward(obs_seq, init_hidden_state)
+        
+        # compute actor loss
+        new_action_log_prob = select_valid(policy_dist_seq.joint_log_prob(action_seq))
+        actor_loss = L.ppo_clipped_loss(
+            advantage,
+            old_action_log_prob,
+            new_action_log_prob,
+            self._config.epsilon_clip
+        )
+        entropy = select_valid(policy_dist_seq.joint_entropy()).mean()
+        
+        # compute critic loss
+        critic_loss = L.bellman_value_loss(select_valid(state_value_seq), target_state_value)
+        
+        loss = actor_loss + self._config.value_loss_coef * critic_loss - self._config.entropy_coef * entropy
+        return loss, actor_loss.detach(), critic_loss.detach()
+
     def _compute_adv_target(self, exp_batch: RecurrentPPOExperience) -> tuple[torch.Tensor, torch.Tensor]:
         """
         Compute advantage, v_target.
 
         Args:
-            exp_batch (PPOExperienceBatch): experience batch
+            exp_batch (RecurrentPPOExperience): experience batch of which each tensor is `(num_envs, n_steps, *shape)`
 
         Returns:
-            advantage (Tensor): `(num_envs x n_steps, 1)`
-            v_target (Tensor): `(num_envs x n_steps, 1)`
+            advantage (Tensor): `(num_envs, n_steps, 1)`
+            v_target (Tensor): `(num_envs, n_steps, 1)`
         """
         
-        # (num_envs, *obs_shape)
-        final_next_obs = exp_batch.next_obs[-self._num_envs:]
-        final_next_hidden_state = self._next_hidden_state.to(device=self.device)
+        # (num_envs, 1, *obs_shape) because sequence length is 1
+        final_next_obs_seq = exp_batch.next_obs[:, -1:]
+        final_next_hidden_state = self._next_hidden_state
         
         # feed forward without gradient calculation
         with torch.no_grad():
-            # (num_envs, 1, *obs_shape) because sequence length is 1
             _, final_next_state_value_seq, _ = self._network.forward(
-                final_next_obs.transform(lambda o: o.unsqueeze(dim=1)),
+                final_next_obs_seq,
                 final_next_hidden_state
             )
         
-        # (num_envs, 1, 1) -> (num_envs, 1)
-        final_next_state_value = final_next_state_value_seq.squeeze_(dim=1)
-        # (num_envs x (n_steps + 1), 1)
-        entire_state_value = torch.cat((exp_batch.state_value, final_next_state_value))
-        
-        # (num_envs x k, 1) -> (num_envs, k, 1) -> (num_envs, k)
-        b2e = lambda x: batch2perenv(x, self._num_envs).squeeze_(dim=-1)
-        entire_state_value = b2e(entire_state_value)
-        reward = b2e(exp_batch.reward)
-        terminated = b2e(exp_batch.terminated)
+        # (num_envs, n_steps + 1, 1) -> (num_envs, n_steps + 1)
+        entire_state_value = torch.cat((exp_batch.state_value, final_next_state_value_seq), dim=1).squeeze_(dim=-1)
         
         # compute advantage (num_envs, n_steps) using GAE
         advantage = L.gae(
             entire_state_value,
-            reward,
-            terminated,
+            exp_batch.reward.squeeze(dim=-1),
+            exp_batch.terminated.squeeze(dim=-1),
             self._config.gamma,
             self._config.lam
         )
@@ -244,12 +318,8 @@ class RecurrentPPO(Agent):
         # compute target state_value (num_envs, n_steps)
         target_state_value = advantage + entire_state_value[:, :-1]
         
-        # (num_envs, n_steps) -> (num_envs x n_steps, 1)
-        e2b = lambda x: perenv2batch(x.unsqueeze_(dim=-1))
-        advantage = e2b(advantage)
-        target_state_value = e2b(target_state_value)
-        
-        return advantage, target_state_value
+        # (num_envs, n_steps) -> (num_envs, n_steps, 1)
+        return advantage.unsqueeze_(dim=-1), target_state_value.unsqueeze_(dim=-1)
 
     @property
     def log_keys(self) -> tuple[str, ...]:
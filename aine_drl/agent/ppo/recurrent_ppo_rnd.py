@@ -44,7 +44,8 @@ class RecurrentPPORND(Agent):
         hidden_state_shape = (network.hidden_state_shape()[0], self._num_envs, network.hidden_state_shape()[1])
         self._hidden_state = torch.zeros(hidden_state_shape, device=self.device)
         self._next_hidden_state = torch.zeros(hidden_state_shape, device=self.device)
-        self._prev_terminated = torch.zeros((self._num_envs, 1), device=self.device)
+        # the mask which resets the hidden state of the terminated environments, it's updated in-place on the device
+        self._prev_not_terminated = torch.ones((self._num_envs, 1), device=self.device)
         # compute intrinic reward normalization parameters of each env along time steps
         self._int_reward_mean_var = util.IncrementalMeanVarianceFromBatch(dim=1, device=self.device) 
         # compute normalization parameters of each feature of next observation along batches
@@ -61,9 +62,9 @@ class RecurrentPPORND(Agent):
         
         # for inference mode
         infer_hidden_state_shape = (network.hidden_state_shape()[0], 1, network.hidden_state_shape()[1])
-        self._infer_current_hidden_state = torch.zeros(infer_hidden_state_shape, device=self.device)
+        self._infer_hidden_state = torch.zeros(infer_hidden_state_shape, device=self.device)
         self._infer_next_hidden_state = torch.zeros(infer_hidden_state_shape, device=self.device)
-        self._infer_prev_terminated = torch.zeros((1, 1), device=self.device)
+        self._infer_prev_not_terminated = torch.ones((1, 1), device=self.device)
         
     @property
     def name(self) -> str:
@@ -74,10 +75,10 @@ class RecurrentPPORND(Agent):
         return self._config.__dict__
     
     def _update_train(self, exp: Experience):
-        self._prev_terminated = exp.terminated
+        self._prev_not_terminated.copy_(exp.terminated, non_blocking=True).neg_().add_(1.0)
         
         # (D x num_layers, num_envs, H) -> (num_envs, D x num_layers, H)
-        next_hidden_state = (self._next_hidden_state * (1.0 - self._prev_terminated)).swapdims(0, 1)
+        next_hidden_state = (self._next_hidden_state * self._prev_not_terminated).swapdims(0, 1)
         
         # initialize normalization parameters
         if (self._config.init_norm_steps is not None) and (self._current_init_norm_steps < self._config.init_norm_steps):
@@ -115,11 +116,11 @@ class RecurrentPPORND(Agent):
             self._train()
     
     def _update_inference(self, exp: Experience):
-        self._infer_prev_terminated = exp.terminated
+        self._infer_prev_not_terminated.copy_(exp.terminated, non_blocking=True).neg_().add_(1.0)
     
     @torch.no_grad()
     def _select_action_train(self, obs: Observation) -> Action:
-        self._hidden_state = self._next_hidden_state * (1.0 - self._prev_terminated)
+        torch.mul(self._next_hidden_state, self._prev_not_terminated, out=self._hidden_state)
             
         # feed forward
         # when interacting with environment, sequence_length must be 1
@@ -144,7 +145,7 @@ class RecurrentPPORND(Agent):
     
     @torch.no_grad()
     def _select_action_inference(self, obs: Observation) -> Action:
-        self._infer_hidden_state = self._infer_next_hidden_state * (1.0 - self._infer_prev_terminated)
+        torch.mul(self._infer_next_hidden_state, self._infer_prev_not_terminated, out=self._infer_hidden_state)
         policy_dist_seq, _, _, next_hidden_state = self._network.forward_actor_critic(
             obs.transform(lambda o: o.unsqueeze(dim=1)),
             self._infer_hidden_state
@@ -170,20 +171,19 @@ class RecurrentPPORND(Agent):
         def add_to_seq_gen(batch, start_idx = 0, seq_len = 0):
             seq_generator.add(batch2perenv(batch, self._num_envs), start_idx=start_idx, seq_len=seq_len)
             
-        add_to_seq_gen(exp_batch.hidden_state.swapaxes(0, 1), seq_len=1)
-        add_to_seq_gen(exp_batch.next_hidden_state.swapaxes(0, 1))
+        seq_generator.add(self._to_perenv_hidden_state(exp_batch.hidden_state), seq_len=1)
+        seq_generator.add(self._to_perenv_hidden_state(exp_batch.next_hidden_state))
         for obs in exp_batch.next_obs.items:
             add_to_seq_gen(obs)
         for next_obs in exp_batch.next_obs.items:
             add_to_seq_gen(next_obs)
-        if exp_batch.action.num_discrete_branches > 0:
+        # the empty action branch is skipped
+        has_discrete_action = exp_batch.action.num_discrete_branches > 0
+        has_continuous_action = exp_batch.action.num_continuous_branches > 0
+        if has_discrete_action:
             add_to_seq_gen(exp_batch.action.discrete_action)
-        else:
-            seq_generator.add(torch.empty((self._num_envs, self._config.n_steps, 0)))
-        if exp_batch.action.num_continuous_branches > 0:
+        if has_continuous_action:
             add_to_seq_gen(exp_batch.action.continuous_action)
-        else:
-            seq_generator.add(torch.empty((self._num_envs, self._config.n_steps, 0)))
         add_to_seq_gen(exp_batch.action_log_prob)
         add_to_seq_gen(advantage)
         add_to_seq_gen(ext_target_state_value)
@@ -200,12 +200,17 @@ class RecurrentPPORND(Agent):
         action_seq_start_idx = next_obs_seq_start_idx + exp_batch.next_obs.num_items
         next_obs_seq = Observation(sequences[next_obs_seq_start_idx:action_seq_start_idx])
         
-        action_seq = Action(*sequences[action_seq_start_idx:action_seq_start_idx + 2])
-        old_action_log_prob_seq, advantage_seq, ext_target_state_value_seq, int_target_state_value_seq = sequences[action_seq_start_idx + 2:]
+        action_seq_end_idx = action_seq_start_idx + has_discrete_action + has_continuous_action
+        action_seqs = iter(sequences[action_seq_start_idx:action_seq_end_idx])
+        action_seq = Action(
+            next(action_seqs) if has_discrete_action else None,
+            next(action_seqs) if has_continuous_action else None
+        )
+        old_action_log_prob_seq, advantage_seq, ext_target_state_value_seq, int_target_state_value_seq = sequences[action_seq_end_idx:]
         
         seq_batch_size = len(mask)
         # (seq_batch_size, 1, D x num_layers, H) -> (D x num_layers, seq_batch_size, H)
-        seq_init_hidden_state = seq_init_hidden_state.squeeze_(dim=1).swapdims_(0, 1)
+        seq_init_hidden_state = seq_init_hidden_state.permute(2, 0, 1, 3).reshape(-1, seq_batch_size, seq_init_hidden_state.shape[-1])
         
         # update next observation and next hidden state normalization parameters
         # when masked by mask, (seq_batch_size, seq_len, *shape) -> (masked_batch_size, *shape)
@@ -222,9 +227,12 @@ class RecurrentPPORND(Agent):
         normalized_next_obs_seq[mask] = self._normalize_next_obs(masked_next_obs)
         normalized_next_hidden_state_seq[mask] = self._normalize_next_hidden_state(masked_next_hidden_state)
         
+        # the number of sequences depends on the episode boundaries, so it's agreed in distributed training
+        num_seq_mini_batches = self._trainer.agree_num_steps(seq_batch_size // self._config.seq_mini_batch_size)
+        
         for _ in range(self._config.epoch):
             shuffled_seq_batch_idx = torch.randperm(seq_batch_size)
-            for i in range(seq_batch_size // self._config.seq_mini_batch_size):
+            for i in range(num_seq_mini_batches):
                 # when sliced by sample_seq, (seq_batch_size,) -> (seq_mini_batch_size,)
                 sample_seq_idx = shuffled_seq_batch_idx[self._config.seq_mini_batch_size * i : self._config.seq_mini_batch_size * (i + 1)]
                 # when masked by m, (seq_mini_batch_size, seq_len,) -> (masked_batch_size,)
@@ -357,6 +365,14 @@ class RecurrentPPORND(Agent):
         
         return advantage, ext_target_state_value, int_target_state_value
     
+    def _to_perenv_hidden_state(self, hidden_state: torch.Tensor) -> torch.Tensor:
+        """
+        `(D x num_layers, n_steps x num_envs, H)` -> `(num_envs, n_steps, D x num_layers, H)`
+        
+        It's a single view instead of swapping axes and converting the batch to per environment.
+        """
+        return hidden_state.reshape(hidden_state.shape[0], -1, self._num_envs, hidden_state.shape[-1]).permute(2, 1, 0, 3)
+    
     def _compute_intrinsic_reward(self, next_obs: Observation, next_hidden_state: torch.Tensor) -> torch.Tensor:
         """
         Compute intrinsic reward.
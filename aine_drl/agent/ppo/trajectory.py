@@ -5,6 +5,15 @@ import torch
 from aine_drl.exp import Action, Observation
 
 
+def _make_step_buffer(n_steps: int, like: torch.Tensor, dim: int = 0) -> torch.Tensor:
+    """Make a buffer whose shape is the shape of `like` with `n_steps` inserted at `dim`."""
+    shape = like.shape[:dim] + (n_steps,) + like.shape[dim:]
+    return torch.empty(shape, dtype=like.dtype, device=like.device)
+
+def _flatten_steps(buffer: torch.Tensor, dim: int = 0) -> torch.Tensor:
+    """`(..., n_steps, num_envs, ...)` -> `(..., n_steps x num_envs, ...)`"""
+    return buffer.flatten(dim, dim + 1)
+
 @dataclass(frozen=True)
 class PPOExperience:
     obs: Observation
@@ -16,8 +25,13 @@ class PPOExperience:
     state_value: torch.Tensor
 
 class PPOTrajectory:
+    """
+    Each buffer is allocated as `(n_steps, num_envs, *shape)` when the first experience is added and it's reused after reset.
+    Note that the sampled experience batch is a view of the buffers, so it's valid only until the next experience is added.
+    """
     def __init__(self, n_steps: int) -> None:
         self._n_steps = n_steps
+        self._obs_buffer: Observation = None # type: ignore
         self.reset()
         
     @property
@@ -26,20 +40,16 @@ class PPOTrajectory:
         
     def reset(self):
         self._recent_idx = -1
-        
-        self._obs_buffer = self._make_buffer()
-        self._action_buffer = self._make_buffer()
-        self._reward_buffer = self._make_buffer()
-        self._terminated_buffer = self._make_buffer()
-        self._action_log_prob_buffer = self._make_buffer()
-        self._state_value_buffer = self._make_buffer()
-        
         self._final_next_obs = None
         
     def add(self, exp: PPOExperience):
+        if self._obs_buffer is None:
+            self._allocate_buffer(exp)
+        
         self._recent_idx += 1
         self._obs_buffer[self._recent_idx] = exp.obs
-        self._action_buffer[self._recent_idx] = exp.action
+        self._action_buffer.discrete_action[self._recent_idx] = exp.action.discrete_action
+        self._action_buffer.continuous_action[self._recent_idx] = exp.action.continuous_action
         self._reward_buffer[self._recent_idx] = exp.reward
         self._terminated_buffer[self._recent_idx] = exp.terminated
         self._action_log_prob_buffer[self._recent_idx] = exp.action_log_prob
@@ -47,21 +57,26 @@ class PPOTrajectory:
         self._final_next_obs = exp.next_obs
         
     def sample(self) -> PPOExperience:
-        self._obs_buffer.append(self._final_next_obs)
+        self._obs_buffer[self._n_steps] = self._final_next_obs # type: ignore
         exp_batch = PPOExperience(
-            Observation.from_iter(self._obs_buffer[:-1]),
-            Action.from_iter(self._action_buffer),
-            Observation.from_iter(self._obs_buffer[1:]),
-            torch.cat(self._reward_buffer, dim=0),
-            torch.cat(self._terminated_buffer, dim=0),
-            torch.cat(self._action_log_prob_buffer, dim=0),
-            torch.cat(self._state_value_buffer, dim=0),
+            self._obs_buffer[:-1].transform(_flatten_steps),
+            self._action_buffer.transform(_flatten_steps),
+            self._obs_buffer[1:].transform(_flatten_steps),
+            _flatten_steps(self._reward_buffer),
+            _flatten_steps(self._terminated_buffer),
+            _flatten_steps(self._action_log_prob_buffer),
+            _flatten_steps(self._state_value_buffer),
         )
         self.reset()
         return exp_batch
     
-    def _make_buffer(self) -> list:
-        return [None] * self._n_steps
+    def _allocate_buffer(self, exp: PPOExperience):
+        self._obs_buffer = exp.obs.transform(lambda o: _make_step_buffer(self._n_steps + 1, o))
+        self._action_buffer = exp.action.transform(lambda a: _make_step_buffer(self._n_steps, a))
+        self._reward_buffer = _make_step_buffer(self._n_steps, exp.reward)
+        self._terminated_buffer = _make_step_buffer(self._n_steps, exp.terminated)
+        self._action_log_prob_buffer = _make_step_buffer(self._n_steps, exp.action_log_prob)
+        self._state_value_buffer = _make_step_buffer(self._n_steps, exp.state_value)
 
 @dataclass(frozen=True)
 class RecurrentPPOExperience:
@@ -75,8 +90,15 @@ class RecurrentPPOExperience:
     hidden_state: torch.Tensor
     
 class RecurrentPPOTrajectory:
+    """
+    Each buffer is allocated as `(num_envs, n_steps, *shape)` when the first experience is added and it's reused after reset.
+    The hidden state buffer is `(num_envs, n_steps, D x num_layers, H)`.
+    Unlike the other trajectories, the sampled experience batch keeps this per-environment layout.
+    Note that the sampled experience batch is a view of the buffers, so it's valid only until the next experience is added.
+    """
     def __init__(self, n_steps: int) -> None:
         self._n_steps = n_steps
+        self._obs_buffer: Observation = None # type: ignore
         self.reset()
         
     @property
@@ -85,46 +107,48 @@ class RecurrentPPOTrajectory:
     
     def reset(self):
         self._recent_idx = -1
-        
-        self._obs_buffer = self._make_buffer()
-        self._action_buffer = self._make_buffer()
-        self._reward_buffer = self._make_buffer()
-        self._terminated_buffer = self._make_buffer()
-        self._action_log_prob_buffer = self._make_buffer()
-        self._state_value_buffer = self._make_buffer()
-        self._hidden_state_buffer = self._make_buffer()
-        
         self._final_next_obs = None
         
     def add(self, exp: RecurrentPPOExperience):
+        if self._obs_buffer is None:
+            self._allocate_buffer(exp)
+        
         self._recent_idx += 1
         
-        self._obs_buffer[self._recent_idx] = exp.obs
-        self._action_buffer[self._recent_idx] = exp.action
-        self._reward_buffer[self._recent_idx] = exp.reward
-        self._terminated_buffer[self._recent_idx] = exp.terminated
-        self._action_log_prob_buffer[self._recent_idx] = exp.action_log_prob
-        self._state_value_buffer[self._recent_idx] = exp.state_value
-        self._hidden_state_buffer[self._recent_idx] = exp.hidden_state
+        self._obs_buffer[:, self._recent_idx] = exp.obs
+        self._action_buffer.discrete_action[:, self._recent_idx] = exp.action.discrete_action
+        self._action_buffer.continuous_action[:, self._recent_idx] = exp.action.continuous_action
+        self._reward_buffer[:, self._recent_idx] = exp.reward
+        self._terminated_buffer[:, self._recent_idx] = exp.terminated
+        self._action_log_prob_buffer[:, self._recent_idx] = exp.action_log_prob
+        self._state_value_buffer[:, self._recent_idx] = exp.state_value
+        # (D x num_layers, num_envs, H) -> (num_envs, D x num_layers, H)
+        self._hidden_state_buffer[:, self._recent_idx] = exp.hidden_state.transpose(0, 1)
         self._final_next_obs = exp.next_obs
         
     def sample(self) -> RecurrentPPOExperience:
-        self._obs_buffer.append(self._final_next_obs)
+        self._obs_buffer[:, self._n_steps] = self._final_next_obs # type: ignore
         exp_batch = RecurrentPPOExperience(
-            Observation.from_iter(self._obs_buffer[:-1]),
-            Action.from_iter(self._action_buffer),
-            Observation.from_iter(self._obs_buffer[1:]),
-            torch.cat(self._reward_buffer, dim=0),
-            torch.cat(self._terminated_buffer, dim=0),
-            torch.cat(self._action_log_prob_buffer, dim=0),
-            torch.cat(self._state_value_buffer, dim=0),
-            torch.cat(self._hidden_state_buffer, dim=1),
+            self._obs_buffer[:, :-1],
+            self._action_buffer,
+            self._obs_buffer[:, 1:],
+            self._reward_buffer,
+            self._terminated_buffer,
+            self._action_log_prob_buffer,
+            self._state_value_buffer,
+            self._hidden_state_buffer,
         )
         self.reset()
         return exp_batch
     
-    def _make_buffer(self) -> list:
-        return [None] * self._n_steps
+    def _allocate_buffer(self, exp: RecurrentPPOExperience):
+        self._obs_buffer = exp.obs.transform(lambda o: _make_step_buffer(self._n_steps + 1, o, dim=1))
+        self._action_buffer = exp.action.transform(lambda a: _make_step_buffer(self._n_steps, a, dim=1))
+        self._reward_buffer = _make_step_buffer(self._n_steps, exp.reward, dim=1)
+        self._terminated_buffer = _make_step_buffer(self._n_steps, exp.terminated, dim=1)
+        self._action_log_prob_buffer = _make_step_buffer(self._n_steps, exp.action_log_prob, dim=1)
+        self._state_value_buffer = _make_step_buffer(self._n_steps, exp.state_value, dim=1)
+        self._hidden_state_buffer = _make_step_buffer(self._n_steps, exp.hidden_state.transpose(0, 1), dim=1)
     
 @dataclass(frozen=True)
 class PPORNDExperience:
@@ -139,8 +163,13 @@ class PPORNDExperience:
     int_state_value: torch.Tensor
     
 class PPORNDTrajectory:
+    """
+    Each buffer is allocated as `(n_steps, num_envs, *shape)` when the first experience is added and it's reused after reset.
+    Note that the sampled experience batch is a view of the buffers, so it's valid only until the next experience is added.
+    """
     def __init__(self, n_steps: int) -> None:
         self._n_steps = n_steps
+        self._obs_buffer: Observation = None # type: ignore
         self.reset()
         
     @property
@@ -149,23 +178,17 @@ class PPORNDTrajectory:
     
     def reset(self):
         self._recent_idx = -1
-        
-        self._obs_buffer = self._make_buffer()
-        self._action_buffer = self._make_buffer()
-        self._ext_reward_buffer = self._make_buffer()
-        self._int_reward_buffer = self._make_buffer()
-        self._terminated_buffer = self._make_buffer()
-        self._action_log_prob_buffer = self._make_buffer()
-        self._ext_state_value_buffer = self._make_buffer()
-        self._int_state_value_buffer = self._make_buffer()
-        
         self._final_next_obs = None
         
     def add(self, exp: PPORNDExperience):
+        if self._obs_buffer is None:
+            self._allocate_buffer(exp)
+        
         self._recent_idx += 1
         
         self._obs_buffer[self._recent_idx] = exp.obs
-        self._action_buffer[self._recent_idx] = exp.action
+        self._action_buffer.discrete_action[self._recent_idx] = exp.action.discrete_action
+        self._action_buffer.continuous_action[self._recent_idx] = exp.action.continuous_action
         self._ext_reward_buffer[self._recent_idx] = exp.ext_reward
         self._int_reward_buffer[self._recent_idx] = exp.int_reward
         self._terminated_buffer[self._recent_idx] = exp.terminated
@@ -175,23 +198,30 @@ class PPORNDTrajectory:
         self._final_next_obs = exp.next_obs
         
     def sample(self) -> PPORNDExperience:
-        self._obs_buffer.append(self._final_next_obs)
+        self._obs_buffer[self._n_steps] = self._final_next_obs # type: ignore
         exp_batch = PPORNDExperience(
-            Observation.from_iter(self._obs_buffer[:-1]),
-            Action.from_iter(self._action_buffer),
-            Observation.from_iter(self._obs_buffer[1:]),
-            torch.cat(self._ext_reward_buffer, dim=0),
-            torch.cat(self._int_reward_buffer, dim=0),
-            torch.cat(self._terminated_buffer, dim=0),
-            torch.cat(self._action_log_prob_buffer, dim=0),
-            torch.cat(self._ext_state_value_buffer, dim=0),
-            torch.cat(self._int_state_value_buffer, dim=0),
+            self._obs_buffer[:-1].transform(_flatten_steps),
+            self._action_buffer.transform(_flatten_steps),
+            self._obs_buffer[1:].transform(_flatten_steps),
+            _flatten_steps(self._ext_reward_buffer),
+            _flatten_steps(self._int_reward_buffer),
+            _flatten_steps(self._terminated_buffer),
+            _flatten_steps(self._action_log_prob_buffer),
+            _flatten_steps(self._ext_state_value_buffer),
+            _flatten_steps(self._int_state_value_buffer),
         )
         self.reset()
         return exp_batch
         
-    def _make_buffer(self) -> list:
-        return [None] * self._n_steps
+    def _allocate_buffer(self, exp: PPORNDExperience):
+        self._obs_buffer = exp.obs.transform(lambda o: _make_step_buffer(self._n_steps + 1, o))
+        self._action_buffer = exp.action.transform(lambda a: _make_step_buffer(self._n_steps, a))
+        self._ext_reward_buffer = _make_step_buffer(self._n_steps, exp.ext_reward)
+        self._int_reward_buffer = _make_step_buffer(self._n_steps, exp.int_reward)
+        self._terminated_buffer = _make_step_buffer(self._n_steps, exp.terminated)
+        self._action_log_prob_buffer = _make_step_buffer(self._n_steps, exp.action_log_prob)
+        self._ext_state_value_buffer = _make_step_buffer(self._n_steps, exp.ext_state_value)
+        self._int_state_value_buffer = _make_step_buffer(self._n_steps, exp.int_state_value)
     
 @dataclass(frozen=True)
 class RecurrentPPORNDExperience:
@@ -208,8 +238,14 @@ class RecurrentPPORNDExperience:
     next_hidden_state: torch.Tensor
 
 class RecurrentPPORNDTrajectory:
+    """
+    Each buffer is allocated as `(n_steps, num_envs, *shape)` when the first experience is added and it's reused after reset.
+    The hidden state buffer is `(D x num_layers, n_steps + 1, num_envs, H)`.
+    Note that the sampled experience batch is a view of the buffers, so it's valid only until the next experience is added.
+    """
     def __init__(self, n_steps: int) -> None:
         self._n_steps = n_steps
+        self._obs_buffer: Observation = None # type: ignore
         self.reset()
         
     @property
@@ -218,53 +254,54 @@ class RecurrentPPORNDTrajectory:
         
     def reset(self):
         self._recent_idx = -1
-        
-        self._obs_buffer = self._make_buffer()
-        self._action_buffer = self._make_buffer()
-        self._ext_reward_buffer = self._make_buffer()
-        self._int_reward_buffer = self._make_buffer()
-        self._terminated_buffer = self._make_buffer()
-        self._action_log_prob_buffer = self._make_buffer()
-        self._ext_state_value_buffer = self._make_buffer()
-        self._int_state_value_buffer = self._make_buffer()
-        self._hidden_state_buffer = self._make_buffer()
-        
         self._final_next_obs = None
         self._final_next_hidden_state = None
         
     def add(self, exp: RecurrentPPORNDExperience):
+        if self._obs_buffer is None:
+            self._allocate_buffer(exp)
+        
         self._recent_idx += 1
         
         self._obs_buffer[self._recent_idx] = exp.obs
-        self._action_buffer[self._recent_idx] = exp.action
+        self._action_buffer.discrete_action[self._recent_idx] = exp.action.discrete_action
+        self._action_buffer.continuous_action[self._recent_idx] = exp.action.continuous_action
         self._ext_reward_buffer[self._recent_idx] = exp.ext_reward
         self._int_reward_buffer[self._recent_idx] = exp.int_reward
         self._terminated_buffer[self._recent_idx] = exp.terminated
         self._action_log_prob_buffer[self._recent_idx] = exp.action_log_prob
         self._ext_state_value_buffer[self._recent_idx] = exp.ext_state_value
         self._int_state_value_buffer[self._recent_idx] = exp.int_state_value
-        self._hidden_state_buffer[self._recent_idx] = exp.hidden_state
+        self._hidden_state_buffer[:, self._recent_idx] = exp.hidden_state
         self._final_next_obs = exp.next_obs
         self._final_next_hidden_state = exp.next_hidden_state
     
     def sample(self) -> RecurrentPPORNDExperience:
-        self._obs_buffer.append(self._final_next_obs)
-        self._hidden_state_buffer.append(self._final_next_hidden_state)
+        self._obs_buffer[self._n_steps] = self._final_next_obs # type: ignore
+        self._hidden_state_buffer[:, self._n_steps] = self._final_next_hidden_state
         exp_batch = RecurrentPPORNDExperience(
-            Observation.from_iter(self._obs_buffer[:-1]),
-            Action.from_iter(self._action_buffer),
-            Observation.from_iter(self._obs_buffer[1:]),
-            torch.cat(self._ext_reward_buffer, dim=0),
-            torch.cat(self._int_reward_buffer, dim=0),
-            torch.cat(self._terminated_buffer, dim=0),
-            torch.cat(self._action_log_prob_buffer, dim=0),
-            torch.cat(self._ext_state_value_buffer, dim=0),
-            torch.cat(self._int_state_value_buffer, dim=0),
-            torch.cat(self._hidden_state_buffer[:-1], dim=1),
-            torch.cat(self._hidden_state_buffer[1:], dim=1),
+            self._obs_buffer[:-1].transform(_flatten_steps),
+            self._action_buffer.transform(_flatten_steps),
+            self._obs_buffer[1:].transform(_flatten_steps),
+            _flatten_steps(self._ext_reward_buffer),
+            _flatten_steps(self._int_reward_buffer),
+            _flatten_steps(self._terminated_buffer),
+            _flatten_steps(self._action_log_prob_buffer),
+            _flatten_steps(self._ext_state_value_buffer),
+            _flatten_steps(self._int_state_value_buffer),
+            _flatten_steps(self._hidden_state_buffer[:, :-1], dim=1),
+            _flatten_steps(self._hidden_state_buffer[:, 1:], dim=1),
         )
         self.reset()
         return exp_batch
     
-    def _make_buffer(self) -> list:
-        return [None] * self._n_steps
\ No newline at end of file
+    def _allocate_buffer(self, exp: RecurrentPPORNDExperience):
+        self._obs_buffer = exp.obs.transform(lambda o: _make_step_buffer(self._n_steps + 1, o))
+        self._action_buffer = exp.action.transform(lambda a: _make_step_buffer(self._n_steps, a))
+        self._ext_reward_buffer = _make_step_buffer(self._n_steps, exp.ext_reward)
+        self._int_reward_buffer = _make_step_buffer(self._n_steps, exp.int_reward)
+        self._terminated_buffer = _make_step_buffer(self._n_steps, exp.terminated)
+        self._action_log_prob_buffer = _make_step_buffer(self._n_steps, exp.action_log_prob)
+        self._ext_state_value_buffer = _make_step_buffer(self._n_steps, exp.ext_state_value)
+        self._int_state_value_buffer = _make_step_buffer(self._n_steps, exp.int_state_value)
+        self._hidden_state_buffer = _make_step_buffer(self._n_steps + 1, exp.hidden_state, dim=1)
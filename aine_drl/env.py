@@ -127,16 +127,17 @@ class GymEnv(Env):
         converted_action = self._action_converter(action)
         next_obs, reward, terminated, truncated, info = self._env.step(converted_action) # type: ignore
         real_final_next_obs = None
-        if "final_observation" in info.keys():
-            final_obs_mask = info["_final_observation"]
+        final_obs = info.get("final_observation")
+        is_final = info.get("_final_observation")
+        if final_obs is not None and is_final.any(): # type: ignore
+            # object array of the final observations of the terminated environments
+            final_obs = final_obs[is_final]
             
             if type(next_obs) == np.ndarray:
-                real_final_next_obs = np.stack(info["final_observation"][final_obs_mask], axis=0)
+                real_final_next_obs = np.stack(final_obs, axis=0)
             else:
-                real_final_next_obs = []
-                for i in range(len(next_obs)):
-                    temp = np.stack(info["final_observation"][final_obs_mask][i], axis=0)
-                    real_final_next_obs.append(temp)
+                # each final observation is a tuple, so stack each item of them
+                real_final_next_obs = [np.stack([obs[i] for obs in final_obs], axis=0) for i in range(len(next_obs))]
         if self._truncate_episode:
             terminated |= truncated
         return (
@@ -35,10 +35,12 @@ class AINEFactory(Generic[T]):
         self._env: Env | None = None
         self._agent = None
         
-        if not logger.enabled():
-            logger.enable(self._id, enable_log_file=False)
-        logger.save_config_dict_to_yaml(config)
-        logger.disable()
+        # only the process of rank 0 saves it in distributed training
+        if util_f.is_main_process():
+            if not logger.enabled():
+                logger.enable(self._id, enable_log_file=False)
+            logger.save_config_dict_to_yaml(config)
+            logger.disable()
     
     @abstractmethod
     def make_env(self) -> "AINEFactory[T]":
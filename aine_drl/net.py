@@ -4,9 +4,12 @@ from dataclasses import dataclass
 from typing import Iterable
 
 import torch
+import torch.distributed as dist
 import torch.nn as nn
 from torch.nn.utils.clip_grad import clip_grad_norm_
 
+import aine_drl.util.func as util_f
+
 
 class Trainer:
     """
@@ -56,11 +59,81 @@ class Trainer:
         """
         Performs a single optimization step (parameter update).
         """
-        self._optimizer.zero_grad()
+        self._optimizer.zero_grad(set_to_none=True)
         loss.backward()
         if self._clip_grad_norm_config is not None:
             clip_grad_norm_(**self._clip_grad_norm_config.__dict__)
         self._optimizer.step()
+        
+    def agree_num_steps(self, num_steps: int) -> int:
+        """
+        Returns the number of optimization steps to perform when it may differ across the training processes. 
+        It's `num_steps` itself in a single process.
+        """
+        return num_steps
+
+class DistributedTrainer(Trainer):
+    """
+    PyTorch optimizer wrapper for single scalar loss in data parallel training (e.g., DD-PPO). 
+    
+    Each process collects experiences from its own environments and computes the loss. 
+    The gradients are averaged across all processes before the parameter update, so the parameters are kept identical. 
+    The parameters and the optimizer state are broadcasted from the process of rank 0 when it's created, so create it before any rollout.
+    
+    Note that the default process group must be initialized by `torch.distributed.init_process_group()` in advance 
+    and every process must call `step()` the same number of times. 
+    When the number of steps depends on the collected experiences, agree on it by `agree_num_steps()`.
+    """
+    def __init__(self, optimizer: torch.optim.Optimizer) -> None:
+        if not dist.is_available() or not dist.is_initialized():
+            raise RuntimeError("the default process group must be initialized before creating DistributedTrainer.")
+        super().__init__(optimizer)
+        self._params = tuple(p for param_group in optimizer.param_groups for p in param_group["params"])
+        self._broadcast_from_rank0()
+    
+    def step(self, loss: torch.Tensor, training_steps: int):
+        """
+        Performs a single optimization step (parameter update) with the gradients averaged across all processes.
+        """
+        self._optimizer.zero_grad(set_to_none=True)
+        loss.backward()
+        self._all_reduce_grad()
+        if self._clip_grad_norm_config is not None:
+            clip_grad_norm_(**self._clip_grad_norm_config.__dict__)
+        self._optimizer.step()
+        
+    def agree_num_steps(self, num_steps: int) -> int:
+        """
+        Returns the minimum of `num_steps` across all processes, so every process performs the same number of steps.
+        """
+        num_steps_tensor = torch.tensor(num_steps, device=util_f.dist_device())
+        dist.all_reduce(num_steps_tensor, op=dist.ReduceOp.MIN)
+        return int(num_steps_tensor.item())
+        
+    @torch.no_grad()
+    def _broadcast_from_rank0(self):
+        tensors = list(self._params)
+        for p in self._params:
+            tensors.extend(t for t in self._optimizer.state[p].values() if isinstance(t, torch.Tensor))
+        # the tensors are staged on the communication device since they may not be on it (e.g., CPU tensors with NCCL)
+        device = util_f.dist_device()
+        for t in tensors:
+            staged_t = t.to(device)
+            dist.broadcast(staged_t, src=0)
+            t.copy_(staged_t)
+        
+    def _all_reduce_grad(self):
+        # every process must reduce the gradients of the same parameters
+        for p in self._params:
+            if p.grad is None:
+                p.grad = torch.zeros_like(p)
+        grads = tuple(p.grad for p in self._params)
+        # the gradients are reduced at once by flattening them into a single tensor
+        flat_grad = torch.cat(tuple(g.flatten() for g in grads)) # type: ignore
+        dist.all_reduce(flat_grad)
+        flat_grad /= dist.get_world_size()
+        for g, reduced_g in zip(grads, flat_grad.split(tuple(g.numel() for g in grads))): # type: ignore
+            g.copy_(reduced_g.view_as(g)) # type: ignore
 
 class NetworkTypeError(TypeError):
     def __init__(self, true_net_type: type) -> None:
@@ -136,7 +209,9 @@ def unwrap_lstm_hidden_state(
         raise ValueError("if `H_out` and `H_cell` are different size, you must specify both of them.")
     
     if (h_size is None) and (c_size is None):
-        h_size = c_size = hc.shape[2] // 2
+        # both of them are made contiguous by a single copy when they're the same size
+        h, c = hc.reshape(hc.shape[0], hc.shape[1], 2, -1).permute(2, 0, 1, 3).contiguous().unbind(0)
+        return h, c
     
-    h, c = hc.split([h_size, c_size], dim=2)
+    h, c = hc.split([h_size, c_size], dim=2) # type: ignore
     return h.contiguous(), c.contiguous()
\ No newline at end of file
@@ -70,7 +70,10 @@ class CategoricalPolicy(Policy):
         return ActionType.DISCRETE
         
     def forward(self, x: torch.Tensor) -> pd.PolicyDist:
-        out = self._layer(x)
+        out = _full_precision(self._layer(x))
+        # splitting is skipped for the single discrete action branch
+        if len(self._num_discrete_actions) == 1:
+            return pd.CategoricalDist(logits=(out,))
         logits = out.split(self._num_discrete_actions, dim=-1)
         return pd.CategoricalDist(logits=logits)
     
@@ -103,7 +106,7 @@ class GaussianPolicy(Policy):
         return ActionType.CONTINUOUS
 
     def forward(self, x: torch.Tensor) -> pd.PolicyDist:
-        out = self._layer(x)
+        out = _full_precision(self._layer(x))
         # restore batch shape
         mean, std = out.split(self._num_continuous_actions, dim=-1)
         std = std.abs() + 1e-8
@@ -153,8 +156,8 @@ class CategoricalGaussianPolicy(Policy):
         return ActionType.BOTH
     
     def forward(self, x: torch.Tensor) -> pd.PolicyDist:
-        categorical_out = self._categorical_layer(x)
-        gaussian_out = self._gaussian_layer(x)
+        categorical_out = _full_precision(self._categorical_layer(x))
+        gaussian_out = _full_precision(self._gaussian_layer(x))
         # get policy distribution parameter
         logits = categorical_out.split(self._num_discrete_actions, dim=-1)
         mean, std = gaussian_out.split(self._num_continuous_actions, dim=-1)
@@ -230,3 +233,7 @@ class PolicyActionTypeError(TypeError):
     def __init__(self, valid_action_type: ActionType, invalid_policy: Policy) -> None:
         message = f"The policy action type must be \"{valid_action_type}\", but \"{type(invalid_policy).__name__}\" is \"{invalid_policy.action_type}\"."
         super().__init__(message)
+        
+def _full_precision(pdparam: torch.Tensor) -> torch.Tensor:
+    # the reduced precision output (e.g., autocast) biases the action sampling
+    return pdparam.float() if pdparam.dtype in (torch.float16, torch.bfloat16) else pdparam
@@ -78,24 +78,45 @@ class CategoricalDist(PolicyDist):
         if probs is None and logits is None:
             raise ValueError("either probs or logits must be specified.")
 
+        # logits are normalized to log probabilities, so the sampling and the log probability need no more normalization
         if probs is not None:
-            self._dist = tuple(D.Categorical(probs=prob) for prob in probs)
+            self._logits = tuple(CategoricalDist._probs_to_logits(prob / prob.sum(dim=-1, keepdim=True)) for prob in probs)
         else:
-            self._dist = tuple(D.Categorical(logits=logit) for logit in logits) # type: ignore
+            self._logits = tuple(logit - logit.logsumexp(dim=-1, keepdim=True) for logit in logits) # type: ignore
+        
+    @staticmethod
+    def _probs_to_logits(probs: torch.Tensor) -> torch.Tensor:
+        # zero probabilities (e.g., masked actions) are kept -inf not to be sampled, 
+        # and the clamp prevents the infinite gradient of log(0)
+        log_probs = probs.clamp(min=torch.finfo(probs.dtype).tiny).log()
+        return torch.where(probs > 0, log_probs, log_probs.new_tensor(float("-inf")))
         
     def sample(self, _: bool = False) -> Action:
-        sampled_discrete_action = [dist.sample() for dist in self._dist]
+        # Gumbel-max trick: argmax(logits + Gumbel noise) follows the categorical distribution
+        # the noise is drawn in float32 since the reduced precision biases the sampling
+        sampled_discrete_action = []
+        for logit in self._logits:
+            if logit.dtype in (torch.float16, torch.bfloat16):
+                logit = logit.float()
+            uniform = torch.rand(logit.shape, dtype=logit.dtype, device=logit.device).clamp_(min=torch.finfo(logit.dtype).tiny)
+            sampled_discrete_action.append((logit - (-uniform.log()).log()).argmax(dim=-1))
         sampled_discrete_action = torch.stack(sampled_discrete_action, dim=-1)
         return Action(discrete_action=sampled_discrete_action)
     
     def log_prob(self, action: Action) -> torch.Tensor:
+        # (*batch_shape, num_branches) -> (*batch_shape, num_branches, 1)
+        discrete_action = action.discrete_action.long().unsqueeze(dim=-1)
         action_log_prob = []
-        for i, dist in enumerate(self._dist):
-            action_log_prob.append(dist.log_prob(action.discrete_action[..., i]))
+        for i, logit in enumerate(self._logits):
+            action_log_prob.append(logit.gather(-1, discrete_action[..., i, :]).squeeze(dim=-1))
         return torch.stack(action_log_prob, dim=-1)
     
     def entropy(self) -> torch.Tensor:
-        entropies = [dist.entropy() for dist in self._dist]
+        entropies = []
+        for logit in self._logits:
+            # clamp to avoid 0 * -inf = nan
+            p_log_p = logit.clamp(min=torch.finfo(logit.dtype).min) * logit.exp()
+            entropies.append(-p_log_p.sum(dim=-1))
         return torch.stack(entropies, dim=-1)
 
 class GaussianDist(PolicyDist):
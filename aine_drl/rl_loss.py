@@ -1,6 +1,11 @@
 import torch
 import torch.nn.functional as F
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
 def true_return(
     reward: torch.Tensor,
     gamma: float
@@ -33,6 +38,9 @@ def gae(
     Compute Generalized Advantage Estimation (GAE) during n-step transitions. 
     
     Paper: https://arxiv.org/abs/1506.02438.
+    
+    If Numba is installed, float32 CPU tensors are computed by the Numba kernel which runs each environment in parallel.
+    Otherwise, it's computed by TorchScript.
 
     Args:
         state_value (Tensor): state value `(num_envs, n_steps + 1)`, 
@@ -45,20 +53,53 @@ def gae(
     Returns:
         GAE (Tensor): `(num_envs, n_steps)`
     """
+    tensors = (state_value, reward, terminated)
+    if _numba_gae is not None and all(
+        t.device.type == "cpu" and t.dtype == torch.float32 and not t.requires_grad for t in tensors
+    ):
+        advantage = torch.empty_like(reward)
+        _numba_gae(state_value.numpy(), reward.numpy(), terminated.numpy(), gamma, lam, advantage.numpy())
+        return advantage
+    return _torch_gae(state_value, reward, terminated, gamma, lam)
+
+@torch.jit.script
+def _torch_gae(
+    state_value: torch.Tensor,
+    reward: torch.Tensor,
+    terminated: torch.Tensor,
+    gamma: float,
+    lam: float
+) -> torch.Tensor:
     n_step = reward.shape[1]
     advantage = torch.empty_like(reward)
-    discounted_gae = 0.0 # GAE at time step t+n
+    discounted_gae = torch.zeros_like(reward[:, 0]) # GAE at time step t+n
     not_terminated = 1 - terminated
     delta = reward + not_terminated * gamma * state_value[:, 1:] - state_value[:, :-1]
     discount_factor = gamma * lam
     
     # compute GAE
-    for t in reversed(range(n_step)):
+    for t in range(n_step - 1, -1, -1):
         discounted_gae = delta[:, t] + not_terminated[:, t] * discount_factor * discounted_gae
         advantage[:, t] = discounted_gae
      
     return advantage
 
+if numba is not None:
+    # compiled lazily at the first call, since the threading layer compiled before the fork 
+    # (e.g., AsyncVectorEnv) can hang the process at exit. the cache avoids the recompilation.
+    @numba.njit(cache=True, parallel=True, fastmath=True)
+    def _numba_gae(state_value, reward, terminated, gamma, lam, advantage):
+        num_envs, n_steps = reward.shape
+        for env_id in numba.prange(num_envs):
+            discounted_gae = 0.0 # GAE at time step t+n
+            for t in range(n_steps - 1, -1, -1):
+                not_terminated = 1.0 - terminated[env_id, t]
+                delta = reward[env_id, t] + gamma * state_value[env_id, t + 1] * not_terminated - state_value[env_id, t]
+                discounted_gae = delta + gamma * lam * not_terminated * discounted_gae
+                advantage[env_id, t] = discounted_gae
+else:
+    _numba_gae = None
+
 def bellman_value_loss(
     predicted_state_value: torch.Tensor,
     target_state_value: torch.Tensor
@@ -42,6 +42,7 @@ class Inference:
         self._trace_env = 0
         
         self._enabled = True
+        self._is_loaded = False
         
     @property
     def config(self) -> InferenceConfig:
@@ -51,6 +52,20 @@ class Inference:
     def config(self, config: InferenceConfig):
         self._config = config
         
+    def load(self) -> "Inference":
+        """
+        Load the saved agent. 
+        It's loaded in `inference()` unless it's already loaded, so you can modify the loaded agent before inference.
+        """
+        if not self._enabled:
+            raise RuntimeError("Inference is already closed.")
+        
+        if not logger.enabled():
+            logger.enable(self._id, enable_log_file=False)
+        self._load_inference()
+        logger.disable()
+        return self
+        
     def inference(self) -> "Inference":
         if not self._enabled:
             raise RuntimeError("Inference is already closed.")
@@ -59,7 +74,8 @@ class Inference:
             if not logger.enabled():
                 logger.enable(self._id, enable_log_file=False)
                 
-            self._load_inference()
+            if not self._is_loaded:
+                self._load_inference()
             
             logger.disable()
             logger.enable(self._id, enable_log_file=False)
@@ -167,3 +183,4 @@ class Inference:
             self._agent.load_state_dict(state_dict["agent"])
         except:
             raise AgentLoadError("the loaded agent is not compatible with the current agent")
+        self._is_loaded = True
@@ -1,10 +1,13 @@
 from __future__ import annotations
 import time
+from collections import deque
 from dataclasses import dataclass
 
 import torch
+import torch.distributed as dist
 
 import aine_drl.util as util
+import aine_drl.util.func as util_f
 from aine_drl.agent.agent import Agent, BehaviorScope, BehaviorType
 from aine_drl.exp import Experience
 from aine_drl.util.logger import TextInfoBox, logger
@@ -33,6 +36,14 @@ class TrainConfig:
         object.__setattr__(self, "agent_save_freq", agent_save_freq)
 
 class Train:
+    # the counters are accessed every time step
+    __slots__ = (
+        "_id", "_config", "_env", "_agent", "_dtype", "_device", "_trace_env",
+        "_time_steps", "_episodes", "_episode_len", "_real_start_time",
+        "_cumulative_reward_mean", "_episode_len_mean", "_enabled", "_pinned_buffers",
+        "_is_distributed", "_is_main_process"
+    )
+    
     def __init__(
         self,
         id: str,
@@ -52,14 +63,22 @@ class Train:
         self._time_steps = 0
         self._episodes = 0
         self._episode_len = 0
-        self._real_start_time = time.time()
-        self._real_time = 0.0
+        self._real_start_time = time.perf_counter()
         
         self._cumulative_reward_mean = util.IncrementalMean()
         self._episode_len_mean = util.IncrementalMean()
         
         self._enabled = True
         
+        # in distributed training, the rollout statistics are averaged across all processes 
+        # and only the process of rank 0 logs and saves the agent
+        self._is_distributed = util_f.is_distributed()
+        self._is_main_process = util_f.is_main_process()
+        
+        # reused pinned host memory buffers to copy the tensors to the CUDA device asynchronously
+        # the buffers of each shape are ordered from the least recently used one
+        self._pinned_buffers: dict[torch.Size, deque[tuple[torch.Tensor, torch.cuda.Event]]] = {}
+        
     def train(self) -> "Train":
         if not self._enabled:
             raise RuntimeError("Train is already closed.")
@@ -74,10 +93,11 @@ class Train:
                 logger.print(f"Training is already finished.")
                 return self
             
-            logger.disable()
-            logger.enable(self._id)
-            
-            self._print_train_info()            
+            if self._is_main_process:
+                logger.disable()
+                logger.enable(self._id)
+                
+                self._print_train_info()            
             
             try:
                 obs = self._env.reset().transform(self._agent_tensor)
@@ -143,14 +163,33 @@ class Train:
     def _tick_time_steps(self):
         self._episode_len += 1
         self._time_steps += 1
-        self._real_time = time.time() - self._real_start_time
+    
+    @property
+    def _real_time(self) -> float:
+        # it's measured only when it's read instead of every time step
+        return time.perf_counter() - self._real_start_time
     
     def _tick_episode(self):
         self._episode_len = 0
         self._episodes += 1
         
     def _agent_tensor(self, x: torch.Tensor) -> torch.Tensor:
-        return x.to(device=self._device, dtype=self._dtype)
+        if self._device.type != "cuda" or x.is_cuda:
+            return x.to(device=self._device, dtype=self._dtype)
+        
+        # stage the host tensor in the pinned memory buffer to copy it without blocking the host
+        pinned_buffers = self._pinned_buffers.setdefault(x.shape, deque())
+        # the buffer is reused only when the previous copy from it is finished, otherwise a new one is allocated
+        if len(pinned_buffers) > 0 and pinned_buffers[0][1].query():
+            pinned_buffer = pinned_buffers.popleft()
+        else:
+            pinned_buffer = (torch.empty(x.shape, dtype=self._dtype, pin_memory=True), torch.cuda.Event())
+        buffer, copied_event = pinned_buffer
+        buffer.copy_(x)
+        device_tensor = buffer.to(device=self._device, non_blocking=True)
+        copied_event.record(torch.cuda.current_stream(self._device))
+        pinned_buffers.append(pinned_buffer)
+        return device_tensor
     
     def _print_train_info(self):
         text_info_box = TextInfoBox() \
@@ -177,20 +216,54 @@ class Train:
         logger.print("", prefix="")
         
     def _summary_train(self):
-        if self._cumulative_reward_mean.count == 0:
+        num_episodes = self._cumulative_reward_mean.count
+        cumulative_reward_mean = self._cumulative_reward_mean.mean
+        episode_len_mean = self._episode_len_mean.mean
+        self._cumulative_reward_mean.reset()
+        self._episode_len_mean.reset()
+        
+        if self._is_distributed:
+            num_episodes, cumulative_reward_mean, episode_len_mean = Train._all_reduce_episode_stats(
+                num_episodes, 
+                cumulative_reward_mean, 
+                episode_len_mean
+            )
+        
+        # the log data is reset when it's read
+        log_data = self._agent.log_data
+        
+        if not self._is_main_process:
+            return
+        
+        if num_episodes == 0:
             reward_info = "episode has not terminated yet"
         else:
-            reward_info = f"cumulated reward: {self._cumulative_reward_mean.mean:.2f}"
-            logger.log("Environment/Cumulative Reward", self._cumulative_reward_mean.mean, self._time_steps)
-            logger.log("Environment/Episode Length", self._episode_len_mean.mean, self._time_steps)
-            self._cumulative_reward_mean.reset()
-            self._episode_len_mean.reset()
+            reward_info = f"cumulated reward: {cumulative_reward_mean:.2f}"
+            logger.log("Environment/Cumulative Reward", cumulative_reward_mean, self._time_steps)
+            logger.log("Environment/Episode Length", episode_len_mean, self._time_steps)
         logger.print(f"training time: {self._real_time:.2f}, time steps: {self._time_steps}, {reward_info}")
         
-        for key, (value, t) in self._agent.log_data.items():
+        for key, (value, t) in log_data.items():
             logger.log(key, value, t)
             
+    @staticmethod
+    def _all_reduce_episode_stats(num_episodes: int, cumulative_reward_mean: float, episode_len_mean: float) -> tuple[int, float, float]:
+        """Returns the total number of episodes and the episode means across all processes."""
+        # the sums are reduced at once
+        sums = torch.tensor(
+            [num_episodes, cumulative_reward_mean * num_episodes, episode_len_mean * num_episodes], 
+            dtype=torch.float64, 
+            device=util_f.dist_device()
+        )
+        dist.all_reduce(sums)
+        total_num_episodes, cumulative_reward_sum, episode_len_sum = sums.tolist()
+        if total_num_episodes == 0:
+            return 0, 0.0, 0.0
+        return int(total_num_episodes), cumulative_reward_sum / total_num_episodes, episode_len_sum / total_num_episodes
+            
     def _save_train(self):
+        if not self._is_main_process:
+            return
         train_dict = dict(
             time_steps=self._time_steps,
             episodes=self._episodes,
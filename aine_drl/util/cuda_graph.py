@@ -0,0 +1,63 @@
+from __future__ import annotations
+from typing import Callable
+
+import torch
+
+class CUDAGraphFn:
+    """
+    ## Summary
+
+    Captures a function of fixed-shape CUDA tensors into a CUDA graph when it's called first, then replays the graph.
+    The graph is captured again when the shapes, the dtypes or the devices of the inputs are changed.
+
+    Note that the returned tensors are static outputs of the graph,
+    so they are overwritten when it's called next time. Clone them if you need to keep them.
+    The graph keeps reading the memory of the tensors captured in `fn` (e.g., network parameters), 
+    so they must be updated in-place like optimizers do. 
+    If they are replaced by new tensors (e.g., `load_state_dict(assign=True)`), create a new `CUDAGraphFn`.
+
+    Args:
+        fn (Callable[..., tuple[Tensor, ...]]): function which takes tensors and returns a tuple of tensors
+        num_warmup (int, optional): the number of calls before capturing. Defaults to 3.
+
+    ## Example
+
+    ::
+
+        graph_fn = CUDAGraphFn(lambda x, h: (x @ h, x.sum(dim=-1)))
+        y, s = graph_fn(torch.randn(4, 8, device="cuda"), torch.randn(8, 8, device="cuda"))
+    """
+    def __init__(self, fn: Callable[..., tuple[torch.Tensor, ...]], num_warmup: int = 3) -> None:
+        self._fn = fn
+        self._num_warmup = num_warmup
+        self._graph = None
+        self._static_inputs: tuple[torch.Tensor, ...] = tuple()
+        self._static_outputs: tuple[torch.Tensor, ...] = tuple()
+
+    def __call__(self, *inputs: torch.Tensor) -> tuple[torch.Tensor, ...]:
+        if self._graph is None or not self._is_compatible(inputs):
+            self._capture(inputs)
+        for static_input, input in zip(self._static_inputs, inputs):
+            static_input.copy_(input, non_blocking=True)
+        self._graph.replay() # type: ignore
+        return self._static_outputs
+
+    def _is_compatible(self, inputs: tuple[torch.Tensor, ...]) -> bool:
+        return len(self._static_inputs) == len(inputs) and all(
+            s.shape == x.shape and s.dtype == x.dtype and s.device == x.device for s, x in zip(self._static_inputs, inputs)
+        )
+
+    def _capture(self, inputs: tuple[torch.Tensor, ...]):
+        self._static_inputs = tuple(input.clone() for input in inputs)
+
+        # warmup on a side stream is required before capturing
+        stream = torch.cuda.Stream()
+        stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(stream): # type: ignore
+            for _ in range(self._num_warmup):
+                self._fn(*self._static_inputs)
+        torch.cuda.current_stream().wait_stream(stream)
+
+        self._graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(self._graph):
+            self._static_outputs = tuple(self._fn(*self._static_inputs))
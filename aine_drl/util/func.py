@@ -8,9 +8,8 @@ from typing import Iterable, TypeVar
 import numpy as np
 import torch
 import torch.backends.cudnn as cudnn
+import torch.distributed as dist
 import torch.nn as nn
-from torch.nn.parameter import Parameter
-from torch.nn.utils.clip_grad import clip_grad_norm_
 
 T = TypeVar("T")
 
@@ -90,6 +89,20 @@ def model_device(model: nn.Module) -> torch.device:
     """Returns the device of the model."""
     return next(model.parameters()).device
 
+def is_distributed() -> bool:
+    """Returns whether the default process group of `torch.distributed` is initialized."""
+    return dist.is_available() and dist.is_initialized()
+
+def is_main_process() -> bool:
+    """Returns whether it's the process of rank 0. It's always `True` when it's not distributed."""
+    return not is_distributed() or dist.get_rank() == 0
+
+def dist_device() -> torch.device:
+    """Returns the device of the tensors communicated by the default process group. NCCL communicates only CUDA tensors."""
+    if dist.get_backend() == "nccl":
+        return torch.device("cuda", torch.cuda.current_device())
+    return torch.device("cpu")
+
 def batch2perenv(batch: torch.Tensor, num_envs: int) -> torch.Tensor:
     """
     `(num_envs x n_steps, *shape)` -> `(num_envs, n_steps, *shape)`
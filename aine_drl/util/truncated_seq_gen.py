@@ -1,6 +1,5 @@
 from typing import Tuple, NamedTuple, List, Optional
 import torch
-from torch.nn.utils.rnn import pad_sequence
 
 class TruncatedSeqGen:
     """
@@ -106,45 +105,55 @@ class TruncatedSeqGen:
         
         # field cashing
         seq_infos = self._seq_infos
-        num_envs = self._num_envs
-        n_steps = self._n_steps
-        full_seq_len = self._full_seq_len
         
-        # add the mask at the beginning of the list
-        mask = torch.ones((num_envs, n_steps))
-        seq_infos.insert(0, TruncatedSeqGen.__SeqInfo(mask, 0, full_seq_len))
+        # the sequence id and the position in the sequence of each element of the flattened batch
+        seq_id, seq_pos = self._compute_seq_idx(interrupted_binary_mask)
+        num_seq = int(seq_id[-1]) + 1
+        max_len = int(seq_pos.max()) + 1
         
-        stacked_batches = [[] for _ in range(len(seq_infos))]
+        # the mask is True at every valid element regardless of the padding value
+        device = seq_infos[0].batch.device
+        mask = torch.zeros((num_seq, max_len), dtype=torch.bool, device=device)
+        mask[seq_id.to(device=device), seq_pos.to(device=device)] = True
         
-        for env_id in range(num_envs):
-            seq_start_t = 0
-            interrupted_idx = 0
+        padded_sequences = [mask]
+        for seq_info in seq_infos:
+            # select the elements within [start_idx, start_idx + seq_len) of each sequence
+            pos = seq_pos - seq_info.start_idx
+            src_idx = ((pos >= 0) & (pos < seq_info.seq_len)).nonzero().squeeze(dim=-1)
+            max_seq_len = max(min(max_len - seq_info.start_idx, seq_info.seq_len), 0)
             
-            interrupted_time_steps = torch.tensor([]) if interrupted_binary_mask is None else torch.where(interrupted_binary_mask[env_id] > 0.5)[0]
-            
-            while seq_start_t < n_steps:
-                # when passing the last time step, it will be zero padded
-                seq_end_t = min(seq_start_t + full_seq_len, n_steps)
-                
-                # if interupped in the middle of the sequence, it will be zero padded
-                if interrupted_idx < len(interrupted_time_steps) and interrupted_time_steps[interrupted_idx] < seq_end_t:
-                    seq_end_t = interrupted_time_steps[interrupted_idx].item() + 1
-                    interrupted_idx += 1
-                
-                for i, seq_info in enumerate(seq_infos):
-                    # determine the sequence range of the current sequence
-                    current_seq_start_t = seq_start_t + seq_info.start_idx
-                    current_seq_end_t = min(current_seq_start_t + seq_info.seq_len, seq_end_t)
-                    current_seq_time_steps = torch.arange(current_seq_start_t, current_seq_end_t)
-                    stacked_batches[i].append(seq_info.batch[env_id, current_seq_time_steps])
-                    
-                seq_start_t = seq_end_t
-                
-        # pad all sequences
-        padded_sequences = []
-        for stacked_batch in stacked_batches:
-            padded_sequences.append(pad_sequence(stacked_batch, batch_first=True, padding_value=self._padding_value))
+            # fill the padding value in advance and scatter all sequences into it at once
+            # the batch is indexed by (env, time step) since flattening the strided batch copies it
+            batch = seq_info.batch
+            padded_sequence = batch.new_full((num_seq, max_seq_len) + batch.shape[2:], self._padding_value)
+            src_idx = src_idx.to(device=batch.device)
+            src_env_idx = torch.div(src_idx, self._n_steps, rounding_mode="floor")
+            src_step_idx = src_idx - src_env_idx * self._n_steps
+            padded_sequence[seq_id.to(device=batch.device)[src_idx], pos.to(device=batch.device)[src_idx]] = batch[src_env_idx, src_step_idx]
+            padded_sequences.append(padded_sequence)
 
-        # convert the float mask to boolean
-        padded_sequences[0] = padded_sequences[0] > 0.5
-        return tuple(padded_sequences)
\ No newline at end of file
+        return tuple(padded_sequences)
+    
+    def _compute_seq_idx(self, interrupted_binary_mask: Optional[torch.Tensor]) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Compute the sequence id and the position in the sequence of each element of the flattened batch `(num_envs x n_steps,)`.
+        The sequence is interrupted right after the interrupted time step and truncated every `full_seq_len` from the beginning of the interrupted one.
+        """
+        num_envs = self._num_envs
+        n_steps = self._n_steps
+        
+        # the episode begins at the first time step or right after the interrupted time step
+        episode_start = torch.zeros((num_envs, n_steps), dtype=torch.bool)
+        episode_start[:, 0] = True
+        if interrupted_binary_mask is not None:
+            episode_start[:, 1:] = interrupted_binary_mask.reshape(num_envs, n_steps)[:, :-1].cpu() > 0.5
+        
+        # the time step at which the current episode begins
+        time_steps = torch.arange(n_steps).expand(num_envs, -1)
+        episode_start_t = torch.where(episode_start, time_steps, torch.zeros_like(time_steps)).cummax(dim=1).values
+        
+        # the sequence begins every `full_seq_len` from the beginning of the episode
+        seq_pos = ((time_steps - episode_start_t) % self._full_seq_len).flatten()
+        seq_id = (seq_pos == 0).cumsum(dim=0) - 1
+        return seq_id, seq_pos
@@ -3,14 +3,18 @@ import sys
 sys.path.append(".")
 
 import argparse
+import inspect
+import os
 
 import gym
 import gym.spaces
 import gym.vector
 import numpy as np
 import torch
+import torch.distributed as dist
 import torch.nn as nn
 import torch.optim as optim
+import yaml
 from gym.core import ObservationWrapper
 
 import aine_drl
@@ -24,37 +28,87 @@ from aine_drl.policy import CategoricalPolicy
 LEARNING_RATE = 3e-4
 GRAD_CLIP_MAX_NORM = 5.0
 
+def mask_to_index(mask: np.ndarray) -> "slice | np.ndarray":
+    """
+    Convert the boolean mask to a slice if the selected indices are an arithmetic progression, otherwise to the integer indices. 
+    Slicing makes a strided view instead of a copy.
+    """
+    idx = np.flatnonzero(mask)
+    if len(idx) == 1:
+        return slice(int(idx[0]), int(idx[0]) + 1)
+    if len(idx) > 1 and np.all(np.diff(idx) == idx[1] - idx[0]):
+        return slice(int(idx[0]), int(idx[-1]) + 1, int(idx[1] - idx[0]))
+    return idx
+
+def make_adam(network: nn.Module) -> optim.Adam:
+    """
+    Make Adam optimizer which updates all the parameters at once by the multi-tensor (foreach) implementation if it's supported (PyTorch >= 1.12).
+    """
+    if "foreach" in inspect.signature(optim.Adam).parameters:
+        return optim.Adam(network.parameters(), lr=LEARNING_RATE, foreach=True)
+    return optim.Adam(network.parameters(), lr=LEARNING_RATE)
+
+def optimize_for_inference(module: nn.Module, example_input: torch.Tensor) -> torch.jit.ScriptModule:
+    """
+    Freeze the scripted module, or the module traced with `example_input` if it's not scripted, and optimize it for inference. 
+    It's warmed up by feeding forward `example_input` since the first call is slow.
+    """
+    if not isinstance(module, torch.jit.ScriptModule):
+        module = torch.jit.trace(module.eval(), example_input)
+    optimized_module = torch.jit.optimize_for_inference(torch.jit.freeze(module.eval()))
+    with torch.no_grad():
+        optimized_module(example_input)
+    return optimized_module
+
+def quantize_for_inference(module: nn.Module) -> nn.Module:
+    """
+    Replace `nn.Linear` and `nn.LSTM` layers of `module` except scripted submodules with int8 dynamically quantized ones in-place. 
+    It's skipped unless `module` is on CPU and a quantized engine is supported since the quantized kernels are CPU only.
+    """
+    supported_engines = [engine for engine in torch.backends.quantized.supported_engines if engine != "none"]
+    if len(supported_engines) == 0 or any(p.device.type != "cpu" for p in module.parameters()):
+        return module
+    if torch.backends.quantized.engine == "none":
+        torch.backends.quantized.engine = supported_engines[0]
+    # scripted submodules can't be converted
+    qconfig_spec = {
+        name: torch.quantization.default_dynamic_qconfig 
+        for name, child in module.named_children() if not isinstance(child, torch.jit.ScriptModule)
+    }
+    return torch.quantization.quantize_dynamic(module, qconfig_spec, dtype=torch.qint8, inplace=True)
+
 class CartPoleNoVel(ObservationWrapper):
     def __init__(self, render_mode = None):
         env = gym.make("CartPole-v1", render_mode=render_mode)
         super().__init__(env)
         
         self._obs_mask = np.array([True, False, True, False])
+        self._obs_idx = mask_to_index(self._obs_mask)
         
         self.observation_space = gym.spaces.Box(
-            env.observation_space.low[self._obs_mask], # type: ignore
-            env.observation_space.high[self._obs_mask], # type: ignore
+            env.observation_space.low[self._obs_idx], # type: ignore
+            env.observation_space.high[self._obs_idx], # type: ignore
         )
         
     def observation(self, observation):
-        return observation[self._obs_mask]
+        return observation[self._obs_idx]
     
     
 class CartPoleNoVelRecurrentPPONet(nn.Module, agent.RecurrentPPOSharedNetwork):
     def __init__(self, obs_features, num_actions) -> None:
         super().__init__()
         
+        self.obs_features = obs_features
         self.recurrent_layer_in_features = 64
         self.hiddeen_features = 128
         self.num_recurrent_layers = 1
         
         # encoding linear layer for feature extraction
-        self.encoding_layer = nn.Sequential(
+        # it's scripted to reduce the dispatch overhead of the small layers
+        self.encoding_layer = torch.jit.script(nn.Sequential(
             nn.Linear(obs_features, self.recurrent_layer_in_features),
             nn.ReLU(),
-            # nn.Linear(128, self.recurrent_layer_in_features),
-            # nn.ReLU()
-        )
+        ))
         
         # recurrent layer for memory ability
         self.recurrent_layer = nn.LSTM(
@@ -73,7 +127,7 @@ class CartPoleNoVelRecurrentPPONet(nn.Module, agent.RecurrentPPOSharedNetwork):
         
     def model(self) -> nn.Module:
         return self
-        
+    
     def forward(self, obs_seq: aine_drl.Observation, hidden_state: torch.Tensor) -> tuple[aine_drl.PolicyDist, torch.Tensor, torch.Tensor]:
         vector_obs_seq = obs_seq.items[0]        
         # feed forward to encoding linear layer
@@ -91,18 +145,33 @@ class CartPoleNoVelRecurrentPPONet(nn.Module, agent.RecurrentPPOSharedNetwork):
         return policy_dist_seq, state_value_seq, next_seq_hidden_state
     
 class CartPoleNoVelNaivePPO(nn.Module, agent.PPOSharedNetwork):
-    def __init__(self, obs_features, num_actions) -> None:
+    def __init__(self, obs_features, num_actions, compile: bool = False, tiny_encoder: bool = False) -> None:
         super().__init__()
         
+        self.obs_features = obs_features
         self.hidden_features = 64
         
         # encoding layer for feature extraction
-        self.encoding_layer = nn.Sequential(
-            nn.Linear(obs_features, 128),
-            nn.ReLU(),
-            nn.Linear(128, self.hidden_features),
-            nn.ReLU(),
-        )
+        # the tiny one is a single layer since the observation has only a few features
+        if tiny_encoder:
+            encoding_layer = nn.Sequential(
+                nn.Linear(obs_features, self.hidden_features),
+                nn.ReLU(),
+            )
+        else:
+            encoding_layer = nn.Sequential(
+                nn.Linear(obs_features, 128),
+                nn.ReLU(),
+                nn.Linear(128, self.hidden_features),
+                nn.ReLU(),
+            )
+        # it's compiled in-place to keep the state dict keys if supported (PyTorch >= 2.2), 
+        # otherwise it's scripted to reduce the dispatch overhead of the small layers
+        if compile and hasattr(encoding_layer, "compile"):
+            encoding_layer.compile(mode="reduce-overhead", dynamic=False)
+            self.encoding_layer = encoding_layer
+        else:
+            self.encoding_layer = torch.jit.script(encoding_layer)
         
         # actor-critic layer
         self.actor = CategoricalPolicy(self.hidden_features, num_actions)
@@ -118,7 +187,28 @@ class CartPoleNoVelNaivePPO(nn.Module, agent.PPOSharedNetwork):
         state_value = self.critic(encoding)
         return policy_dist, state_value
     
+def optimize_network_for_inference(network: "CartPoleNoVelRecurrentPPONet | CartPoleNoVelNaivePPO"):
+    """
+    Optimize the loaded network for inference in-place. 
+    The encoding layer is frozen and the other layers are quantized, so the network can't be trained or loaded anymore.
+    """
+    device = next(network.parameters()).device
+    if isinstance(network, CartPoleNoVelRecurrentPPONet):
+        example_obs = torch.zeros((1, 1, network.obs_features), device=device)
+    else:
+        example_obs = torch.zeros((1, network.obs_features), device=device)
+    encoding_layer = network.encoding_layer
+    # the compiled one can't be traced, so its layers are traced in a new container
+    if not isinstance(encoding_layer, torch.jit.ScriptModule):
+        encoding_layer = nn.Sequential(*encoding_layer)
+    network.encoding_layer = optimize_for_inference(encoding_layer, example_obs)
+    quantize_for_inference(network)
+    
 class RecurrentPPOFactory(AgentFactory):
+    def __init__(self, distributed: bool = False) -> None:
+        self._distributed = distributed
+        self.network: CartPoleNoVelRecurrentPPONet | None = None
+    
     def make(self, env: aine_drl.Env, config_dict: dict) -> agent.Agent:
         config = agent.RecurrentPPOConfig(**config_dict)
         
@@ -126,11 +216,10 @@ class RecurrentPPOFactory(AgentFactory):
             obs_features=env.obs_spaces[0][0],
             num_actions=env.action_space.discrete[0]
         )
+        self.network = network
         
-        trainer = aine_drl.Trainer(optim.Adam(
-            network.parameters(),
-            lr=LEARNING_RATE
-        )).enable_grad_clip(network.parameters(), max_norm=GRAD_CLIP_MAX_NORM)
+        trainer_cls = aine_drl.DistributedTrainer if self._distributed else aine_drl.Trainer
+        trainer = trainer_cls(make_adam(network)).enable_grad_clip(network.parameters(), max_norm=GRAD_CLIP_MAX_NORM)
             
         return agent.RecurrentPPO(
             config,
@@ -140,18 +229,25 @@ class RecurrentPPOFactory(AgentFactory):
         )
         
 class NaivePPOFactory(AgentFactory):
+    def __init__(self, compile: bool = False, distributed: bool = False, tiny_encoder: bool = False) -> None:
+        self._compile = compile
+        self._distributed = distributed
+        self._tiny_encoder = tiny_encoder
+        self.network: CartPoleNoVelNaivePPO | None = None
+    
     def make(self, env: aine_drl.Env, config_dict: dict) -> agent.Agent:
         config = agent.PPOConfig(**config_dict)
         
         network = CartPoleNoVelNaivePPO(
             obs_features=env.obs_spaces[0][0],
-            num_actions=env.action_space.discrete[0]
+            num_actions=env.action_space.discrete[0],
+            compile=self._compile,
+            tiny_encoder=self._tiny_encoder
         )
+        self.network = network
         
-        trainer = aine_drl.Trainer(optim.Adam(
-            network.parameters(),
-            lr=LEARNING_RATE
-        )).enable_grad_clip(network.parameters(), max_norm=GRAD_CLIP_MAX_NORM)
+        trainer_cls = aine_drl.DistributedTrainer if self._distributed else aine_drl.Trainer
+        trainer = trainer_cls(make_adam(network)).enable_grad_clip(network.parameters(), max_norm=GRAD_CLIP_MAX_NORM)
                 
         return agent.PPO(
             config,
@@ -164,24 +260,48 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-i", "--inference", action="store_true", help="inference mode")
     parser.add_argument("-a", "--agent", type=str, default="recurrent_ppo", help="agent type (recurrent_ppo, naive_ppo)")
+    parser.add_argument("-c", "--compile", action="store_true", help="compile the naive PPO encoding layer with torch.compile (PyTorch >= 2.2)")
+    parser.add_argument("--tiny-encoder", action="store_true", help="use the single layer encoder for the naive PPO")
+    parser.add_argument("--ddppo", action="store_true", help="decentralized distributed training launched by `torchrun --nproc_per_node=N`")
     args = parser.parse_args()
     is_inference = args.inference
     agent_type = args.agent
+    is_distributed = args.ddppo and not is_inference
+    
+    if is_distributed:
+        dist.init_process_group("nccl" if torch.cuda.is_available() else "gloo")
+        rank, world_size = dist.get_rank(), dist.get_world_size()
+        if torch.cuda.is_available():
+            torch.cuda.set_device(int(os.environ.get("LOCAL_RANK", 0)))
+    else:
+        rank, world_size = 0, 1
     
     recurrent_ppo_config_path = "config/experiments/cartpole_v1_no_velocity_recurrent_ppo.yaml"
     naive_ppo_config_path = "config/experiments/cartpole_v1_no_velocity_naive_ppo.yaml"
     
     if agent_type == "recurrent_ppo":
         config_path = recurrent_ppo_config_path
-        agent_factory = RecurrentPPOFactory()
+        agent_factory = RecurrentPPOFactory(distributed=is_distributed)
     elif agent_type == "naive_ppo":
         config_path = naive_ppo_config_path
-        agent_factory = NaivePPOFactory()
+        agent_factory = NaivePPOFactory(compile=args.compile, distributed=is_distributed, tiny_encoder=args.tiny_encoder)
     else:
         raise ValueError("invalid agent type")
     
     if not is_inference:
-        aine_factory =  AINETrainFactory.from_yaml(config_path)
+        if is_distributed:
+            # the environments are sharded across the processes 
+            # and only the process of rank 0 logs and saves the agent
+            with open(config_path) as f:
+                config = yaml.load(f, yaml.FullLoader)
+            config_id = tuple(config.keys())[0]
+            train_dict = config[config_id]["Train"]
+            train_dict["num_envs"] = max(train_dict.get("num_envs", 1) // world_size, 1)
+            if isinstance(train_dict.get("seed"), int):
+                train_dict["seed"] += rank
+            aine_factory = AINETrainFactory(config)
+        else:
+            aine_factory = AINETrainFactory.from_yaml(config_path)
         
         env = GymEnv(gym.vector.AsyncVectorEnv([
             lambda: CartPoleNoVel() for _ in range(aine_factory.num_envs)
@@ -192,13 +312,21 @@ if __name__ == "__main__":
             .ready() \
             .train() \
             .close()
+        
+        if is_distributed:
+            dist.destroy_process_group()
     else:
         aine_factory = AINEInferenceFactory.from_yaml(config_path)
         
         env = GymRenderableEnv(CartPoleNoVel(render_mode="rgb_array"), seed=aine_factory.seed)
         
-        aine_factory.set_env(env) \
+        inference = aine_factory.set_env(env) \
             .make_agent(agent_factory) \
             .ready() \
-            .inference() \
+            .load()
+        
+        # the loaded network is used only for inference
+        optimize_network_for_inference(agent_factory.network) # type: ignore
+        
+        inference.inference() \
             .close()
\ No newline at end of file
@@ -0,0 +1,48 @@
+import pytest
+import torch
+import torch.nn as nn
+import torch.optim as optim
+
+pytest.importorskip("mlagents_envs")
+
+import aine_drl
+import aine_drl.agent as agent
+from aine_drl.policy import CategoricalPolicy
+
+
+class _Net(nn.Module, agent.PPOSharedNetwork):
+    def __init__(self, obs_features: int, probs: torch.Tensor) -> None:
+        super().__init__()
+        self.encoding_layer = nn.Sequential(nn.Linear(obs_features, 32), nn.ReLU())
+        self.actor = CategoricalPolicy(32, len(probs))
+        self.critic = nn.Linear(32, 1)
+        # the policy ignores the encoding and always outputs the logits of `probs`
+        with torch.no_grad():
+            self.actor._layer.weight.zero_()
+            self.actor._layer.bias.copy_(probs.log())
+        
+    def model(self) -> nn.Module:
+        return self
+    
+    def forward(self, obs: aine_drl.Observation) -> tuple[aine_drl.PolicyDist, torch.Tensor]:
+        encoding = self.encoding_layer(obs.items[0])
+        return self.actor(encoding), self.critic(encoding)
+
+def test_autocast_sampling_follows_probs():
+    torch.manual_seed(0)
+    num_envs = 200000
+    probs = torch.tensor([0.001, 0.004, 0.995])
+    net = _Net(4, probs)
+    ppo = agent.PPO(
+        agent.PPOConfig(n_steps=16, epoch=1, mini_batch_size=8, autocast=True),
+        net,
+        aine_drl.Trainer(optim.Adam(net.parameters())),
+        num_envs
+    )
+    
+    action = ppo.select_action(aine_drl.Observation((torch.randn(num_envs, 4),)))
+    
+    freqs = action.discrete_action.flatten().bincount(minlength=len(probs)) / num_envs
+    assert torch.allclose(freqs, probs, rtol=0.2)
+    assert ppo._action_log_prob.dtype == torch.float32
+    assert ppo._state_value.dtype == torch.float32
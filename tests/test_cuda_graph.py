@@ -0,0 +1,62 @@
+import pytest
+import torch
+
+if not torch.cuda.is_available():
+    pytest.skip("CUDA graph requires a CUDA device", allow_module_level=True)
+
+import torch.nn as nn
+import torch.optim as optim
+
+import aine_drl
+import aine_drl.agent as agent
+from aine_drl.policy import CategoricalPolicy
+from aine_drl.util.cuda_graph import CUDAGraphFn
+
+
+class _Net(nn.Module, agent.PPOSharedNetwork):
+    def __init__(self, obs_features: int, num_actions: int) -> None:
+        super().__init__()
+        self.encoding_layer = nn.Sequential(nn.Linear(obs_features, 32), nn.ReLU())
+        self.actor = CategoricalPolicy(32, num_actions)
+        self.critic = nn.Linear(32, 1)
+        
+    def model(self) -> nn.Module:
+        return self
+    
+    def forward(self, obs: aine_drl.Observation) -> tuple[aine_drl.PolicyDist, torch.Tensor]:
+        encoding = self.encoding_layer(obs.items[0])
+        return self.actor(encoding), self.critic(encoding)
+
+def _sample_with_seed(fn, seed: int, *inputs: torch.Tensor) -> tuple[torch.Tensor, ...]:
+    torch.cuda.manual_seed(seed)
+    return tuple(out.clone() for out in fn(*inputs))
+
+def test_graph_and_eager_sampling_agree():
+    torch.manual_seed(0)
+    num_envs = 8
+    net = _Net(4, 3)
+    ppo = agent.PPO(
+        agent.PPOConfig(n_steps=16, epoch=1, mini_batch_size=8, device="cuda", cuda_graph=True),
+        net,
+        aine_drl.Trainer(optim.Adam(net.parameters())),
+        num_envs
+    )
+    assert isinstance(ppo._sample_action_fn, CUDAGraphFn)
+    
+    obs = torch.randn(num_envs, 4, device="cuda")
+    with torch.no_grad():
+        # the first call captures the graph
+        ppo._sample_action_fn(obs)
+        for seed in range(3):
+            graph_outputs = _sample_with_seed(ppo._sample_action_fn, seed, obs)
+            eager_outputs = _sample_with_seed(ppo._sample_action, seed, obs)
+            discrete_action, _, action_log_prob, state_value = graph_outputs
+            assert torch.equal(discrete_action, eager_outputs[0])
+            assert torch.allclose(action_log_prob, eager_outputs[2])
+            assert torch.allclose(state_value, eager_outputs[3])
+
+def test_graph_is_captured_again_when_dtype_is_changed():
+    graph_fn = CUDAGraphFn(lambda x: (x * 2,))
+    x = torch.ones(4, device="cuda")
+    assert graph_fn(x)[0].dtype == torch.float32
+    assert torch.equal(graph_fn(x.double())[0], x.double() * 2)
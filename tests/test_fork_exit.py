@@ -0,0 +1,26 @@
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("mlagents_envs")
+pytest.importorskip("gym")
+
+if sys.platform == "win32":
+    pytest.skip("fork is not available", allow_module_level=True)
+
+# the vectorized environments are forked after aine_drl is imported as in the training
+_FORK_AFTER_IMPORT = """
+import gym
+from gym.vector import AsyncVectorEnv
+
+import aine_drl
+
+env = AsyncVectorEnv([lambda: gym.make("CartPole-v1") for _ in range(2)], context="fork")
+env.reset(seed=0)
+env.close()
+"""
+
+def test_process_exits_after_fork():
+    result = subprocess.run([sys.executable, "-c", _FORK_AFTER_IMPORT], timeout=120)
+    assert result.returncode == 0